@@ -0,0 +1,57 @@
+"""
+Стоимость вставки и поиска в индексе повторов по мере его роста.
+
+    python -m bench.dedupIndex [--sizes 1000,10000,50000] [--distance 6]
+"""
+import argparse, json, random, time
+
+from controllers import dedupIndex
+
+
+def run(sizes, maxDistance, queries=1000, seed=1):
+    rng = random.Random(seed)
+    index = dedupIndex.DedupIndex(':memory:', maxDistance=maxDistance)
+    stored = []
+    results = []
+    for size in sizes:
+        batch = [rng.getrandbits(64) for _ in range(size - len(stored))]
+        started = time.perf_counter()
+        for value in batch:
+            index.add(value)
+        insertSeconds = time.perf_counter() - started
+        stored.extend(batch)
+
+        # половина запросов - слегка изменённые сохранённые хэши, половина - новые
+        probes = []
+        for number in range(queries):
+            if number % 2:
+                value = rng.choice(stored)
+                for bit in rng.sample(range(64), rng.randint(0, maxDistance)):
+                    value ^= 1 << bit
+                probes.append(value)
+            else:
+                probes.append(rng.getrandbits(64))
+        started = time.perf_counter()
+        hits = sum(index.isDuplicate(value) for value in probes)
+        querySeconds = time.perf_counter() - started
+
+        results.append({
+            'size': len(index),
+            'insertUs': insertSeconds / len(batch) * 1e6 if batch else None,
+            'queryUs': querySeconds / len(probes) * 1e6,
+            'hits': hits,
+            'queries': len(probes),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--distance', type=int, default=dedupIndex.MAX_DISTANCE)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    print(json.dumps({'maxDistance': args.distance, 'results': run(sizes, args.distance)}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Локальные заменители Telegram Bot API, VK API и cataas для нагрузочных прогонов.
+
+У каждого сервера настраиваются задержка ответа и доля ответов с ошибкой.
+"""
+import json, random, re, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    # прогон открывает много соединений сразу, стандартной очереди в 5 не хватает
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class FakeServer:
+    """
+    HTTP-сервер в отдельном потоке.
+
+    latency - задержка каждого ответа в секундах, jitter - случайная добавка к ней,
+    errorRate - доля запросов, на которые отвечаем ошибкой.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, errorRate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.errors = Counter()
+        # (время прихода, маршрут) каждого запроса, для проверок частоты
+        self.arrivals = []
+        self.lock = threading.Lock()
+
+        self.server = FakeHTTPServer(('127.0.0.1', 0), self._handlerClass())
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'errors': dict(self.errors)}
+
+    def peakRate(self, key=None, window=1.0):
+        """Наибольшее число запросов (к маршруту key или всех) за любые window секунд."""
+        with self.lock:
+            times = [moment for moment, route in self.arrivals if key is None or route == key]
+        peak = 0
+        first = 0
+        for last, moment in enumerate(times):
+            while moment - times[first] >= window:
+                first += 1
+            peak = max(peak, last - first + 1)
+        return peak
+
+    def _handlerClass(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.handle_request(None)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.handle_request(self.rfile.read(length))
+
+            def handle_request(self, body):
+                path = urlparse(self.path).path
+                with fake.lock:
+                    delay = fake.latency + (fake.random.uniform(0, fake.jitter) if fake.jitter else 0)
+                    failing = fake.errorRate and fake.random.random() < fake.errorRate
+                    key = fake.route(path)
+                    fake.requests[key] += 1
+                    fake.arrivals.append((time.monotonic(), key))
+                    if failing:
+                        fake.errors[key] += 1
+                if delay:
+                    time.sleep(delay)
+
+                if failing:
+                    code, contentType, data = fake.error(path)
+                else:
+                    code, contentType, data = fake.respond(path, self.headers, body)
+                self.send_response(code)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def route(self, path):
+        return path
+
+    def json(self, value, code=200):
+        return code, 'application/json', json.dumps(value).encode()
+
+    def error(self, path):
+        return self.json({'error': 'injected'}, 500)
+
+    def respond(self, path, headers, body):
+        raise NotImplementedError
+
+
+def formParams(headers, body):
+    """Параметры запроса из urlencoded или multipart тела (файлы пропускаются)."""
+    if not body:
+        return {}
+    contentType = headers.get('Content-Type', '')
+    if contentType.startswith('multipart/form-data'):
+        params = {}
+        boundary = contentType.split('boundary=')[1].encode()
+        for part in body.split(b'--' + boundary):
+            head, _, value = part.partition(b'\r\n\r\n')
+            match = re.search(rb'name="([^"]+)"', head)
+            if match and b'filename=' not in head:
+                params[match.group(1).decode()] = value[:-2].decode()
+        return params
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+class FakeTelegram(FakeServer):
+    """Bot API: отвечает на любой метод, sendMessage/sendPhoto возвращают сообщение."""
+    def route(self, path):
+        return path.rsplit('/', 1)[-1]
+
+    def error(self, path):
+        return self.json({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: injected',
+                          'parameters': {'retry_after': 1}}, 429)
+
+    def respond(self, path, headers, body):
+        params = formParams(headers, body)
+        message = {'message_id': self.random.randint(1, 10 ** 6), 'date': int(time.time()),
+                   'chat': {'id': int(params.get('chat_id', 0) or 0), 'type': 'private'},
+                   'text': params.get('text', '')}
+        method = self.route(path)
+        if method in ('sendMessage', 'sendPhoto', 'editMessageText'):
+            return self.json({'ok': True, 'result': message})
+        if method == 'getMe':
+            return self.json({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}})
+        return self.json({'ok': True, 'result': True})
+
+
+TOO_MANY_REQUESTS = {'error_code': 6, 'error_msg': 'Too many requests per second'}
+
+
+class FakeVkError(Exception):
+    def __init__(self, error):
+        super().__init__(error['error_msg'])
+        self.error = error
+
+
+class FakeVk(FakeServer):
+    """
+    VK API: wall.post, wall.get (filter=suggests), загрузка фото на стену и execute.
+
+    suggests - сколько предложенных постов лежит в паблике, у каждого
+    photoEvery-го есть фото с imageUrl. rateLimit, если задан, - сколько
+    запросов в секунду VK принимает, сверх этого отвечает ошибкой 6, как
+    настоящий. Методы из limited всегда получают ошибку 6.
+    """
+    def __init__(self, suggests=50, photoEvery=5, imageUrl=None, rateLimit=None, limited=(), **kwargs):
+        super().__init__(**kwargs)
+        self.imageUrl = imageUrl
+        self.rateLimit = rateLimit
+        self.limited = set(limited)
+        self.suggests = [{
+            'id': number,
+            'from_id': 1000 + number,
+            'date': int(time.time()) - number * 60,
+            'text': f'Предложенный пост {number}',
+            'attachments': self._photo(number) if imageUrl and number % photoEvery == 0 else [],
+        } for number in range(suggests, 0, -1)]
+        self.postId = 0
+
+    def _photo(self, number):
+        return [{'type': 'photo', 'photo': {'id': number, 'owner_id': -1, 'sizes': [
+            {'type': 'm', 'width': 130, 'height': 98, 'url': f'{self.imageUrl}?suggest={number}'}]}}]
+
+    def route(self, path):
+        return path.rsplit('/', 1)[-1]
+
+    def error(self, path):
+        if path.endswith('/upload'):
+            return self.json({'error': 'injected'}, 500)
+        return self.json({'error': TOO_MANY_REQUESTS})
+
+    def overLimit(self):
+        if not self.rateLimit:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            recent = sum(1 for moment, route in self.arrivals if now - moment < 1 and route != 'upload')
+        return recent > self.rateLimit
+
+    def respond(self, path, headers, body):
+        if path.endswith('/upload'):
+            return self.json({'server': 1, 'photo': '[{"photo":"bench"}]', 'hash': 'bench'})
+        if self.overLimit():
+            with self.lock:
+                self.errors[self.route(path)] += 1
+            return self.json({'error': TOO_MANY_REQUESTS})
+        params = formParams(headers, body)
+        method = self.route(path)
+        if method == 'execute':
+            # упавший вызов даёт false, его ошибка - в execute_errors
+            responses, errors = [], []
+            for name, args in parseExecute(params['code']):
+                try:
+                    responses.append(self.call(name, args))
+                except FakeVkError as e:
+                    responses.append(False)
+                    errors.append(dict(e.error, method=name))
+            result = {'response': responses}
+            if errors:
+                result['execute_errors'] = errors
+            return self.json(result)
+        try:
+            return self.json({'response': self.call(method, params)})
+        except FakeVkError as e:
+            return self.json({'error': e.error})
+
+    def call(self, method, params):
+        if method in self.limited:
+            raise FakeVkError(TOO_MANY_REQUESTS)
+        if method == 'wall.post':
+            with self.lock:
+                self.postId += 1
+                return {'post_id': self.postId}
+        if method == 'wall.get':
+            offset, count = int(params.get('offset', 0)), int(params.get('count', 20))
+            return {'count': len(self.suggests), 'items': self.suggests[offset:offset + count]}
+        if method == 'photos.getWallUploadServer':
+            return {'upload_url': f'{self.url}/upload', 'album_id': 1, 'user_id': 1}
+        if method == 'photos.saveWallPhoto':
+            with self.lock:
+                self.postId += 1
+                return [{'id': self.postId, 'owner_id': -1}]
+        return 1
+
+
+def parseExecute(code):
+    """Вызовы API.method({...}) из кода execute, как их собирает vkClient."""
+    decoder = json.JSONDecoder()
+    calls = []
+    position = code.find('API.')
+    while position != -1:
+        bracket = code.index('(', position)
+        args, end = decoder.raw_decode(code, bracket + 1)
+        calls.append((code[position + 4:bracket], args))
+        position = code.find('API.', end)
+    return calls
+
+
+class FakeImages(FakeServer):
+    """cataas: на каждый запрос новая шумовая картинка, чтобы не срабатывала проверка на повторы."""
+    def __init__(self, size=(640, 480), **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+
+    def route(self, path):
+        return 'image'
+
+    def error(self, path):
+        return 503, 'text/plain', b'injected'
+
+    def respond(self, path, headers, body):
+        buffer = BytesIO()
+        Image.effect_noise(self.size, 64).convert('RGB').save(buffer, 'JPEG', quality=80)
+        return 200, 'image/jpeg', buffer.getvalue()
@@ -0,0 +1,345 @@
+"""
+Нагрузочный прогон бота против локальных заменителей Telegram, VK и cataas.
+
+Сценарии гоняют настоящие хендлеры из main.py и модули controllers:
+
+    start       - /start от админов и посторонних вперемешку
+    generate    - одновременные нажатия "Создать пост"
+    suggestions - открытие предложки, листание страниц и "Обновить"
+
+Каждый сценарий прогоняется в каждом режиме бота:
+
+    polling - хендлеры telebot из main.py в пуле потоков
+    async   - асинхронный бот (BOT_MODE=async), до concurrency апдейтов в работе
+    webhook - POST апдейтов на WebhookServer (BOT_MODE=webhook) с concurrency воркерами
+
+Задержка апдейта - от передачи боту до конца обработки, для webhook - от
+отправки POST, то есть вместе с очередью воркера. Каждый режим начинает
+с пустых баз. Результат - JSON с пропускной способностью, p50/p95/p99 и
+пиковой памятью, его удобно сравнивать между ревизиями:
+
+    python -m bench.run --count 200 --concurrency 16 --latency 20 --output bench.json
+"""
+import argparse, asyncio, json, logging, os, subprocess, sys, tempfile, threading, time, tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+
+from bench.fakes import FakeImages, FakeTelegram, FakeVk
+from controllers.imagePipeline import peakRss
+
+ADMIN_ID = 1
+GUEST_ID = 2
+WEBHOOK_SECRET = 'bench'
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(share * len(ordered) + 0.5) - 1))]
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Updates:
+    """Сборка апдейтов Telegram так, как их присылает Bot API."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updateId = 0
+
+    def nextId(self):
+        with self.lock:
+            self.updateId += 1
+            return self.updateId
+
+    def command(self, user_id, text='/start'):
+        number = self.nextId()
+        return {'update_id': number, 'message': {
+            'message_id': number, 'date': int(time.time()), 'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'}}}
+
+    def callback(self, user_id, data):
+        number = self.nextId()
+        return {'update_id': number, 'callback_query': {
+            'id': f'bench-{number}', 'chat_instance': 'bench', 'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+            'message': {'message_id': number, 'date': int(time.time()),
+                        'chat': {'id': user_id, 'type': 'private'}}}}
+
+
+def configure(workdir, telegram, vk, images, rateLimit):
+    """Окружение для main.py: все внешние адреса - на заменители, все базы - во временный каталог."""
+    os.environ.update({
+        'TELEGRAM_TOKEN': '1:bench',
+        'VK_TOKEN': 'bench',
+        'ADMIN_ID': str(ADMIN_ID),
+        'VK_GROUP_ID': '1',
+        'VK_API_URL': vk.url,
+        'VK_RATE_LIMIT': str(rateLimit),
+        'CAT_URL': f'{images.url}/cat',
+        'IMAGE_CACHE_DIR': os.path.join(workdir, 'images'),
+        'SUGGEST_DB': os.path.join(workdir, 'suggests.sqlite3'),
+        'POST_QUEUE_DB': os.path.join(workdir, 'posts.sqlite3'),
+        'DEDUP_DB': os.path.join(workdir, 'hashes.sqlite3'),
+        'SUGGEST_SYNC_INTERVAL': '3600',
+    })
+    import telebot
+    telebot.apihelper.API_URL = telegram.url + '/bot{0}/{1}'
+
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    # хендлеры выполняются в потоках прогона, как в воркерах telebot
+    main.bot.threaded = False
+    return main
+
+
+class ErrorLog(logging.Handler):
+    """Собирает исключения, которые бот только логирует (async и webhook их не пробрасывают)."""
+    def __init__(self, logger):
+        super().__init__(logging.ERROR)
+        self.logger = logger
+        self.errors = []
+
+    def emit(self, record):
+        if record.exc_info:
+            error = record.exc_info[1]
+            self.errors.append(f'{type(error).__name__}: {error}')
+
+    def __enter__(self):
+        self.logger.addHandler(self)
+        return self.errors
+
+    def __exit__(self, *exc):
+        self.logger.removeHandler(self)
+
+
+def resetStorage(workdir, mode):
+    """Новые пустые базы для режима, чтобы первый сценарий каждого режима синхронизировал предложку заново."""
+    from controllers import dedupIndex, postQueue, suggestIndex
+
+    directory = os.path.join(workdir, mode)
+    os.makedirs(directory, exist_ok=True)
+    suggestIndex.index = suggestIndex.SuggestIndex(os.path.join(directory, 'suggests.sqlite3'))
+    postQueue.queue = postQueue.PostQueue(os.path.join(directory, 'posts.sqlite3'))
+    dedupIndex.index = dedupIndex.DedupIndex(os.path.join(directory, 'hashes.sqlite3'))
+
+
+def drivePolling(main, telegram, vk, updates, concurrency):
+    """Прогоняет апдейты через bot.process_new_updates, возвращает задержки и ошибки."""
+    import telebot
+
+    latencies = []
+    errors = []
+
+    def handle(raw):
+        update = telebot.types.Update.de_json(raw)
+        started = time.perf_counter()
+        try:
+            main.bot.process_new_updates([update])
+        except Exception as e:
+            errors.append(f'{type(e).__name__}: {e}')
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(handle, updates))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def driveAsync(main, telegram, vk, updates, concurrency):
+    """Прогоняет апдейты через asyncBot.createBot с maxTasks=concurrency."""
+    import telebot
+    from controllers import asyncBot
+
+    latencies = []
+
+    async def work():
+        async with httpx.AsyncClient() as client:
+            bot = asyncBot.createBot(main.TELEGRAM_TOKEN, main.VK_TOKEN, client, apiUrl=telegram.url,
+                                     vkApiUrl=vk.url, maxTasks=concurrency)
+            started = time.perf_counter()
+            tasks = []
+            for raw in updates:
+                task = await bot.dispatch(telebot.types.Update.de_json(raw))
+                handed = time.perf_counter()
+                task.add_done_callback(lambda _, handed=handed: latencies.append(time.perf_counter() - handed))
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - started
+
+    with ErrorLog(logging.getLogger(asyncBot.__name__)) as errors:
+        elapsed = asyncio.run(work())
+    return latencies, errors, elapsed
+
+
+def driveWebhook(main, telegram, vk, updates, concurrency):
+    """POST апдейтов на WebhookServer, как их шлёт Telegram, до concurrency запросов одновременно."""
+    from controllers import webhook
+
+    sent = {}
+    latencies = []
+    lock = threading.Lock()
+
+    class Recorder:
+        def process_new_updates(self, batch):
+            try:
+                main.bot.process_new_updates(batch)
+            finally:
+                now = time.perf_counter()
+                with lock:
+                    latencies.extend(now - sent[update.update_id] for update in batch)
+
+    server = webhook.WebhookServer(Recorder(), secret=WEBHOOK_SECRET, host='127.0.0.1', port=0, workers=concurrency)
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    headers = {'Content-Type': 'application/json', webhook.SECRET_HEADER: WEBHOOK_SECRET}
+    rejected = []
+
+    def post(raw):
+        sent[raw['update_id']] = time.perf_counter()
+        response = session.post(f'http://127.0.0.1:{server.port}/', data=json.dumps(raw), headers=headers, timeout=30)
+        if response.status_code != 200:
+            rejected.append(f'HTTP {response.status_code}')
+
+    server.start()
+    try:
+        with ErrorLog(logging.getLogger(webhook.__name__)) as errors:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(post, updates))
+            server.join()
+            elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+    return latencies, errors + rejected, elapsed
+
+
+def report(mode, name, rssBefore, latencies, errors, elapsed):
+    return {
+        'mode': mode,
+        'scenario': name,
+        'updates': len(latencies),
+        'errors': len(errors),
+        'errorSamples': sorted(set(errors))[:5],
+        'seconds': round(elapsed, 4),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50Ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95Ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99Ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'peakRss': peakRss(),
+        # пик RSS за всю жизнь процесса только растёт, для сравнения сценариев - на сколько его поднял этот
+        'peakRssGrowth': peakRss() - rssBefore if rssBefore is not None else None,
+        'tracedPeak': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+    }
+
+
+def scenarioStart(updates, count):
+    return [updates.command(ADMIN_ID if number % 2 else GUEST_ID + number) for number in range(count)]
+
+
+def scenarioGenerate(updates, count):
+    return [updates.callback(ADMIN_ID, 'generate_post') for _ in range(count)]
+
+
+def scenarioSuggestions(updates, count):
+    # первое открытие синхронизирует индекс, дальше листание и обновления
+    batch = [updates.callback(ADMIN_ID, 'suggestion')]
+    for number in range(count - 1):
+        if number % 10 == 9:
+            batch.append(updates.callback(ADMIN_ID, 'suggestion_refresh'))
+        else:
+            batch.append(updates.callback(ADMIN_ID, f'suggestion_page:{number % 8}'))
+    return batch
+
+
+SCENARIOS = {
+    'start': scenarioStart,
+    'generate': scenarioGenerate,
+    'suggestions': scenarioSuggestions,
+}
+
+MODES = {
+    'polling': drivePolling,
+    'async': driveAsync,
+    'webhook': driveWebhook,
+}
+
+
+def run(args):
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    fakeOptions = {'latency': args.latency / 1000, 'jitter': args.jitter / 1000,
+                   'errorRate': args.error_rate, 'seed': args.seed}
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeTelegram(**fakeOptions) as telegram, \
+            FakeImages(**fakeOptions) as images, \
+            FakeVk(suggests=args.suggests, imageUrl=f'{images.url}/cat', **fakeOptions) as vk:
+        main = configure(workdir, telegram, vk, images, args.vk_rate)
+        updates = Updates()
+
+        results = []
+        for mode in args.modes.split(','):
+            resetStorage(workdir, mode)
+            for name in args.scenarios.split(','):
+                batch = SCENARIOS[name](updates, args.count)
+                if tracemalloc.is_tracing():
+                    tracemalloc.reset_peak()
+                rssBefore = peakRss()
+                results.append(report(mode, name, rssBefore, *MODES[mode](main, telegram, vk, batch, args.concurrency)))
+
+        return {
+            'revision': revision(),
+            'python': sys.version.split()[0],
+            'config': {
+                'modes': args.modes,
+                'count': args.count,
+                'concurrency': args.concurrency,
+                'latencyMs': args.latency,
+                'jitterMs': args.jitter,
+                'errorRate': args.error_rate,
+                'vkRateLimit': args.vk_rate,
+                'suggests': args.suggests,
+            },
+            'scenarios': results,
+            'fakes': {'telegram': telegram.stats(), 'vk': vk.stats(), 'images': images.stats()},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--modes', default=','.join(MODES), help='bot modes to run every scenario in')
+    parser.add_argument('--count', type=int, default=100, help='updates per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='updates handled at once')
+    parser.add_argument('--latency', type=float, default=10, help='fake server latency, ms')
+    parser.add_argument('--jitter', type=float, default=5, help='random extra latency, ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of fake responses that fail')
+    parser.add_argument('--vk-rate', type=float, default=20, help='VK requests per second per token')
+    parser.add_argument('--suggests', type=int, default=50, help='suggested posts in the fake public')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tracemalloc', action='store_true', help='also report Python heap peak (slower)')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    result = json.dumps(run(args), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(result + '\n')
+    else:
+        print(result)
+
+if __name__ == "__main__":
+    main()
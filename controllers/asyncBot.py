@@ -0,0 +1,259 @@
+import os, logging, asyncio, json
+
+import httpx
+import telebot
+
+from controllers import admin, generateData, postVk, messages, suggestIndex, vkClient, metrics
+
+logger = logging.getLogger(__name__)
+
+# адреса API можно подменить локальными серверами
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# сколько апдейтов одного чата обрабатывается одновременно
+MAX_CHAT_TASKS = int(os.getenv('MAX_CHAT_TASKS', 2))
+# сколько апдейтов всего может быть в работе, дальше polling ждёт
+MAX_TASKS = int(os.getenv('MAX_TASKS', 100))
+POLLING_TIMEOUT = 30
+
+
+class AsyncBot:
+    """
+    Асинхронный бот поверх общего httpx.AsyncClient.
+    Вызовы VK идут через vkClient.VkClient, его Future ожидаются без блокировки.
+
+    Апдейты обрабатываются конкурентно, но не больше maxChatTasks на чат
+    и не больше maxTasks всего. Хендлеры регистрируются так же, как в telebot.
+    """
+    def __init__(self, token, vkToken, client, apiUrl=TELEGRAM_API_URL, vkApiUrl=vkClient.VK_API_URL,
+                 maxChatTasks=MAX_CHAT_TASKS, maxTasks=MAX_TASKS):
+        self.token = token
+        self.client = client
+        self.apiUrl = apiUrl.rstrip('/')
+        self.vkClient = vkClient.VkClient(vkToken, apiUrl=vkApiUrl)
+        self.maxChatTasks = maxChatTasks
+        self.tasks = asyncio.Semaphore(maxTasks)
+        self.running = set()
+        # chat_id -> [семафор, сколько апдейтов его держат или ждут]
+        self.chatLimits = {}
+        self.messageHandlers = []
+        self.callbackHandlers = []
+
+    def message_handler(self, commands):
+        def decorator(handler):
+            self.messageHandlers.append((commands, handler))
+            return handler
+        return decorator
+
+    def callback_query_handler(self, func):
+        def decorator(handler):
+            self.callbackHandlers.append((func, handler))
+            return handler
+        return decorator
+
+    async def request(self, method, data=None, files=None, timeout=None):
+        url = f'{self.apiUrl}/bot{self.token}/{method}'
+        response = await self.client.post(url, data=data, files=files, timeout=timeout)
+        try:
+            result = response.json()
+        except ValueError:
+            # не JSON - например, HTML-страница 502 от шлюза Telegram
+            result = {'ok': False, 'error_code': response.status_code, 'description': response.text[:200]}
+        if not result.get('ok'):
+            raise telebot.apihelper.ApiTelegramException(method, response, result)
+        return result['result']
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        data = {'chat_id': chat_id, 'text': text}
+        if reply_markup is not None:
+            data['reply_markup'] = reply_markup.to_json()
+        return await self.request('sendMessage', data)
+
+    async def send_photo(self, chat_id, photo, caption=None):
+        data = {'chat_id': chat_id}
+        if caption:
+            data['caption'] = caption
+        return await self.request('sendPhoto', data, files={'photo': (photo.filename, photo.reader())})
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        data = {'chat_id': chat_id, 'message_id': message_id, 'text': text}
+        if reply_markup is not None:
+            data['reply_markup'] = reply_markup.to_json()
+        return await self.request('editMessageText', data)
+
+    async def answer_callback_query(self, callback_query_id):
+        return await self.request('answerCallbackQuery', {'callback_query_id': callback_query_id})
+
+    async def get_updates(self, offset=None, timeout=POLLING_TIMEOUT):
+        data = {'timeout': timeout, 'allowed_updates': json.dumps(['message', 'callback_query'])}
+        if offset is not None:
+            data['offset'] = offset
+        return await self.request('getUpdates', data, timeout=timeout + 10)
+
+    async def delete_webhook(self):
+        return await self.request('deleteWebhook')
+
+    async def vk(self, method, **params):
+        return await asyncio.wrap_future(self.vkClient.call(method, **params))
+
+    async def uploadWallPhoto(self, image, group_id=None):
+        """Асинхронный вариант postVk.getImgPost."""
+        group_id = postVk.groupId(group_id)
+        server = await self.vk('photos.getWallUploadServer', group_id=group_id)
+        with metrics.vkRequest('photos.upload'):
+            response = await self.client.post(server['upload_url'], files={'photo': (image.filename, image.reader())},
+                                              timeout=postVk.UPLOAD_TIMEOUT)
+            response.raise_for_status()
+        uploaded = response.json()
+        photo = (await self.vk('photos.saveWallPhoto', group_id=group_id, photo=uploaded['photo'],
+                               server=uploaded['server'], hash=uploaded['hash']))[0]
+        return f"photo{photo['owner_id']}_{photo['id']}"
+
+    async def suggestedEntries(self, page=0, sync=True, force=False, group_id=None):
+        """Асинхронный вариант postVk.suggestedEntries, SQLite работает в отдельном потоке."""
+        index = suggestIndex.getIndex()
+        owner_id = -postVk.groupId(group_id)
+        loop = asyncio.get_running_loop()
+
+        def fetch(offset, count):
+            call = self.vk('wall.get', owner_id=owner_id, filter='suggests', offset=offset, count=count)
+            return asyncio.run_coroutine_threadsafe(call, loop).result()
+
+        if force:
+            await asyncio.to_thread(index.sync, fetch, postVk.reviewSuggestions, True)
+        elif sync:
+            await asyncio.to_thread(index.syncIfStale, fetch, postVk.reviewSuggestions)
+        return await asyncio.to_thread(index.page, page)
+
+    def findHandler(self, update):
+        if update.message is not None:
+            text = update.message.text or ''
+            if text.startswith('/'):
+                command = text[1:].split()[0].split('@')[0]
+                for commands, handler in self.messageHandlers:
+                    if command in commands:
+                        return handler, update.message
+        elif update.callback_query is not None:
+            for func, handler in self.callbackHandlers:
+                if func(update.callback_query):
+                    return handler, update.callback_query
+        return None, None
+
+    def chatId(self, update):
+        if update.message is not None:
+            return update.message.chat.id
+        if update.callback_query is not None and update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return None
+
+    async def process_update(self, update):
+        handler, event = self.findHandler(update)
+        if handler is None:
+            return
+
+        chat_id = self.chatId(update)
+        limit = self.chatLimits.setdefault(chat_id, [asyncio.Semaphore(self.maxChatTasks), 0])
+        limit[1] += 1
+        try:
+            async with limit[0]:
+                await handler(event)
+        except Exception:
+            logger.exception("Update %s failed", update.update_id)
+        finally:
+            limit[1] -= 1
+            if not limit[1]:
+                del self.chatLimits[chat_id]
+
+    async def dispatch(self, update):
+        """Запускает обработку апдейта в фоне, ждёт, если в работе уже maxTasks."""
+        await self.tasks.acquire()
+        task = asyncio.create_task(self.process_update(update))
+        self.running.add(task)
+        task.add_done_callback(self.taskDone)
+        return task
+
+    def taskDone(self, task):
+        self.running.discard(task)
+        self.tasks.release()
+
+    async def process_new_updates(self, updates):
+        for update in updates:
+            await self.dispatch(update)
+
+    async def polling(self):
+        # после запуска в режиме webhook getUpdates отвечал бы 409, пока webhook не снят
+        await self.delete_webhook()
+        offset = None
+        metrics.heartbeat('poller')
+        while True:
+            try:
+                updates = await self.get_updates(offset)
+                metrics.heartbeat('poller')
+            except (httpx.HTTPError, telebot.apihelper.ApiTelegramException) as e:
+                logger.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+
+            for raw in updates:
+                offset = raw['update_id'] + 1
+                await self.dispatch(telebot.types.Update.de_json(raw))
+
+    async def close(self):
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
+
+def createBot(token, vkToken, client, **kwargs):
+    bot = AsyncBot(token, vkToken, client, **kwargs)
+
+    @bot.message_handler(commands=['start'])
+    @metrics.handler('start_message')
+    async def start_message(message):
+        user_id = message.from_user.id
+        chat_id = message.chat.id
+
+        if (admin.checkAdmin(user_id)):
+            await bot.send_message(chat_id, messages.START_ADMIN, reply_markup=messages.startKeyboard())
+        else:
+            await bot.send_message(user_id, messages.START_GUEST)
+
+    @bot.callback_query_handler(func=lambda call: call.data in ('suggestion', 'suggestion_refresh'))
+    @metrics.handler('suggestion_post')
+    async def suggestion_post(call):
+        chat_id = call.message.chat.id
+        entries, total = await bot.suggestedEntries(force=call.data == 'suggestion_refresh')
+        text, keyboard = messages.suggestionPage(entries, 0, total)
+        await bot.send_message(chat_id, text, reply_markup=keyboard)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith('suggestion_page:'))
+    @metrics.handler('suggestion_page')
+    async def suggestion_page(call):
+        message = call.message
+        page = int(call.data.split(':')[1])
+        entries, total = await bot.suggestedEntries(page, sync=False)
+        text, keyboard = messages.suggestionPage(entries, page, total)
+        await bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=keyboard)
+
+    @bot.callback_query_handler(func=lambda call: call.data == 'generate_post')
+    @metrics.handler('generate_post')
+    async def generate_post(call):
+        chat_id = call.message.chat.id
+        await bot.send_message(chat_id, messages.GENERATE)
+        # кодирование картинки - работа для CPU, уводим её из event loop
+        genPost = await asyncio.to_thread(generateData.generatePost.generateEncodedImg)
+        await bot.send_photo(chat_id, genPost)
+        package = postVk.buildPackage(genPost, await bot.uploadWallPhoto(genPost), music=postVk.getMusicPost())
+        post = await asyncio.to_thread(postVk.createPost, package, f'tg-{call.id}')
+        await bot.send_message(chat_id, messages.scheduled(post))
+
+    return bot
+
+
+async def run(token, vkToken):
+    limits = httpx.Limits(max_connections=MAX_TASKS, max_keepalive_connections=20)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(15)) as client:
+        bot = createBot(token, vkToken, client)
+        try:
+            await bot.polling()
+        finally:
+            await bot.close()
@@ -0,0 +1,179 @@
+import os, logging, itertools, sqlite3, threading, time
+from io import BytesIO
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('DEDUP_DB', os.path.join('.cache', 'hashes.sqlite3'))
+# до какого расстояния Хэмминга картинки считаются одинаковыми
+MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', 6))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash INTEGER NOT NULL,
+    source TEXT,
+    created INTEGER NOT NULL
+);
+"""
+
+
+def imageHash(source):
+    """
+    64-битный dHash: картинка сжимается до 9x8 в оттенках серого, каждый бит -
+    ярче ли пиксель своего соседа справа. source - байты или PIL.Image.
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        image = Image.open(BytesIO(source))
+        # для JPEG сразу декодируем в малом масштабе
+        image.draft('L', (64, 64))
+    pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = (value << 1) | (left > pixels[row * 9 + col + 1])
+    return value
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
+
+
+# SQLite хранит знаковые 64-битные числа
+def toSigned(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def toUnsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class MultiIndex:
+    """
+    Multi-index hashing по расстоянию Хэмминга.
+
+    64 бита делятся на BLOCKS блоков. Если хэш отличается от искомого не больше
+    чем на maxDistance бит, то хотя бы в одном блоке отличие не больше
+    maxDistance // BLOCKS. Поэтому кандидатов ищем по таблицам блоков, перебирая
+    только ключи в этом малом радиусе, и уже их сверяем целиком.
+    """
+    BLOCKS = 4
+    BLOCK_BITS = 64 // BLOCKS
+    BLOCK_MASK = (1 << BLOCK_BITS) - 1
+
+    def __init__(self):
+        self.tables = [{} for _ in range(self.BLOCKS)]
+        # hash -> источники, одинаковые хэши хранятся один раз
+        self.sources = {}
+        self.size = 0
+        self.masks = {}
+
+    def blocks(self, value):
+        return [(value >> (self.BLOCK_BITS * number)) & self.BLOCK_MASK for number in range(self.BLOCKS)]
+
+    def radiusMasks(self, radius):
+        """Все маски блока, в которых взведено не больше radius бит."""
+        if radius not in self.masks:
+            masks = [0]
+            for bits in range(1, radius + 1):
+                for positions in itertools.combinations(range(self.BLOCK_BITS), bits):
+                    masks.append(sum(1 << position for position in positions))
+            self.masks[radius] = masks
+        return self.masks[radius]
+
+    def add(self, value, source=None):
+        self.size += 1
+        if value in self.sources:
+            self.sources[value].append(source)
+            return
+        self.sources[value] = [source]
+        for table, key in zip(self.tables, self.blocks(value)):
+            table.setdefault(key, []).append(value)
+
+    def find(self, value, maxDistance):
+        """Все (расстояние, hash, источники) в пределах maxDistance, от ближних к дальним."""
+        masks = self.radiusMasks(maxDistance // self.BLOCKS)
+        candidates = set()
+        for table, key in zip(self.tables, self.blocks(value)):
+            for mask in masks:
+                bucket = table.get(key ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+
+        found = []
+        for candidate in candidates:
+            d = distance(value, candidate)
+            if d <= maxDistance:
+                found.append((d, candidate, self.sources[candidate]))
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class DedupIndex:
+    """
+    Индекс уже использованных картинок.
+
+    Хэши хранятся в SQLite, при открытии по ним строится MultiIndex в памяти.
+    """
+    def __init__(self, path=DB_PATH, maxDistance=MAX_DISTANCE):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.maxDistance = maxDistance
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.hashes = MultiIndex()
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+            for value, source in self.db.execute('SELECT hash, source FROM hashes ORDER BY id'):
+                self.hashes.add(toUnsigned(value), source)
+        logger.info("Dedup index loaded: %s hashes", self.hashes.size)
+
+    def __len__(self):
+        return self.hashes.size
+
+    def find(self, value, maxDistance=None):
+        with self.lock:
+            return self.hashes.find(value, self.maxDistance if maxDistance is None else maxDistance)
+
+    def isDuplicate(self, value, maxDistance=None):
+        return bool(self.find(value, maxDistance))
+
+    def add(self, value, source=None):
+        with self.lock:
+            self._insert(value, source)
+
+    def addIfNew(self, value, source=None, maxDistance=None):
+        """
+        Добавляет хэш, если похожего ещё нет. Проверка и запись идут под одной
+        блокировкой, так что из двух одинаковых картинок, проверяемых
+        одновременно, новой окажется только одна. True - хэш добавлен.
+        """
+        with self.lock:
+            if self.hashes.find(value, self.maxDistance if maxDistance is None else maxDistance):
+                return False
+            self._insert(value, source)
+        return True
+
+    # вызывается под self.lock
+    def _insert(self, value, source):
+        with self.db:
+            self.db.execute('INSERT INTO hashes (hash, source, created) VALUES (?, ?, ?)',
+                            (toSigned(value), source, int(time.time())))
+        self.hashes.add(value, source)
+
+
+index = None
+indexLock = threading.Lock()
+
+# общий индекс, открывается при первом обращении
+def getIndex():
+    global index
+    with indexLock:
+        if index is None:
+            index = DedupIndex()
+    return index
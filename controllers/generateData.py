@@ -1,14 +1,34 @@
-import requests
+import os, logging
 from io import BytesIO
 from PIL import Image
 
+from controllers import imagePool, imagePipeline, dedupIndex
+
+logger = logging.getLogger(__name__)
+
+# сколько картинок перебрать в поисках ещё не публиковавшейся
+DEDUP_ATTEMPTS = int(os.getenv('DEDUP_ATTEMPTS', 5))
+
 class generatePost:
 
+    # картинка берётся из заранее скачанного пула, см. imagePool
     def generateImg():
-        response  = requests.get('https://cataas.com/cat')
-        return Image.open(BytesIO(response.content))
+        return Image.open(BytesIO(imagePool.getPool().take()))
+
+
+    # картинка, один раз приведённая к формату поста, для превью и загрузки в VK;
+    # уже публиковавшиеся и похожие на них пропускаются
+    def generateEncodedImg():
+        index = dedupIndex.getIndex()
+        for _ in range(DEDUP_ATTEMPTS):
+            image = imagePipeline.normalize(imagePool.getPool().take())
+            image.hash = dedupIndex.imageHash(image.view)
+            if not index.isDuplicate(image.hash):
+                return image
+        logger.warning("No unique image in %s attempts, offering a duplicate", DEDUP_ATTEMPTS)
+        return image
 
 
     def generateMusic():
         pass
-    
\ No newline at end of file
+    
@@ -0,0 +1,138 @@
+import os, io, logging, time
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# параметры нормализации картинки для поста
+MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 1280))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG').upper()
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+# защита от картинок-бомб: больше стольких пикселей не декодируем
+MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 50_000_000))
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+
+class ViewReader(io.RawIOBase):
+    """Файловый объект поверх memoryview, read() отдаёт срезы без копирования."""
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, min(offset, len(self.view)))
+        return self.position
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        chunk = self.view[self.position:end]
+        self.position = end
+        return chunk
+
+
+class EncodedImage:
+    """
+    Картинка, закодированная один раз.
+
+    Байты лежат в одном буфере, превью в Telegram и загрузка в VK читают их
+    через view/reader() без копирования.
+    """
+    def __init__(self, buffer, format, size, stats):
+        self.buffer = buffer
+        self.format = format
+        self.size = size
+        self.stats = stats
+        # перцептивный хэш, заполняется проверкой на повторы (dedupIndex)
+        self.hash = None
+        self.filename = 'photo.' + EXTENSIONS.get(format, format.lower())
+
+    @property
+    def view(self):
+        return self.buffer.getbuffer()
+
+    def reader(self):
+        return ViewReader(self.view)
+
+    def __len__(self):
+        return self.buffer.getbuffer().nbytes
+
+
+def peakRss():
+    """Пиковое потребление памяти процессом в байтах, если платформа умеет."""
+    if resource is None:
+        return None
+    # ru_maxrss на linux в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def normalize(source, maxSide=MAX_SIDE, format=IMAGE_FORMAT, quality=IMAGE_QUALITY, maxPixels=MAX_PIXELS):
+    """
+    Уменьшает картинку до maxSide по большей стороне, поворачивает по EXIF,
+    выкидывает метаданные и кодирует в JPEG/WebP.
+
+    source - байты, файловый объект или путь. Картинку больше maxPixels
+    не декодирует, а бросает Image.DecompressionBombError.
+    """
+    started = time.perf_counter()
+    rssBefore = peakRss()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        inputBytes = len(source)
+        source = BytesIO(source)
+    elif isinstance(source, (str, os.PathLike)):
+        inputBytes = os.path.getsize(source)
+    else:
+        inputBytes = None
+
+    with Image.open(source) as original:
+        # open читает только заголовок, размер известен до декодирования
+        width, height = original.size
+        if width * height > maxPixels:
+            raise Image.DecompressionBombError(f"Image has {width * height} pixels, limit is {maxPixels}")
+        # JPEG декодируется сразу в уменьшенном масштабе, не разворачиваясь целиком
+        original.draft('RGB', (maxSide, maxSide))
+        image = ImageOps.exif_transpose(original)
+
+    # грубое уменьшение в целое число раз дешевле, чем ресемплинг всей картинки
+    factor = max(image.size) // maxSide
+    if factor >= 2:
+        image = image.reduce(factor)
+    image.thumbnail((maxSide, maxSide), Image.LANCZOS)
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    buffer = BytesIO()
+    # exif и icc не передаём, поэтому в результат они не попадают
+    image.save(buffer, format, quality=quality, optimize=True)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        'inputBytes': inputBytes,
+        'outputBytes': buffer.getbuffer().nbytes,
+        'seconds': elapsed,
+        'bytesPerSec': (inputBytes or 0) / elapsed if elapsed else None,
+        # на сколько эта картинка подняла пик памяти процесса, 0 - уложилась в прежний пик
+        'peakRssGrowth': peakRss() - rssBefore if resource is not None else None,
+    }
+    logger.info("Image normalized to %sx%s %s: %s", image.size[0], image.size[1], format, stats)
+    return EncodedImage(buffer, format, image.size, stats)
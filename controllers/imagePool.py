@@ -0,0 +1,188 @@
+import os, logging, threading, time, uuid
+from collections import OrderedDict
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+from controllers import metrics
+
+logger = logging.getLogger(__name__)
+
+# адрес источника картинок, можно подменить локальным сервером
+CAT_URL = os.getenv('CAT_URL', 'https://cataas.com/cat')
+CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join('.cache', 'images'))
+# сколько картинок держать наготове и сколько места они могут занять
+POOL_SIZE = int(os.getenv('IMAGE_POOL_SIZE', 10))
+POOL_BYTES = int(os.getenv('IMAGE_POOL_BYTES', 50 * 1024 * 1024))
+# при скольких оставшихся картинках начинать докачку
+POOL_LOW_WATER = int(os.getenv('IMAGE_POOL_LOW_WATER', 3))
+FETCH_TIMEOUT = 15
+RETRY_DELAY = 5
+
+
+class ImagePool:
+    """
+    Пул заранее скачанных картинок на диске.
+
+    Фоновый поток держит до maxCount картинок (не больше maxBytes) и докачивает
+    их, когда осталось lowWater или меньше. Скачивание идёт через одну
+    requests.Session, так что соединение с источником переиспользуется.
+    При переполнении вытесняются давно не использованные картинки.
+    """
+    def __init__(self, url=CAT_URL, cacheDir=CACHE_DIR, maxCount=POOL_SIZE, maxBytes=POOL_BYTES,
+                 lowWater=POOL_LOW_WATER, session=None):
+        self.url = url
+        self.cacheDir = cacheDir
+        self.maxCount = maxCount
+        self.maxBytes = maxBytes
+        self.lowWater = min(lowWater, maxCount - 1)
+        self.session = session or self._createSession()
+
+        # имя файла -> размер, от давно использованных к недавним
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.refill = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self._loadCache()
+
+    def _createSession(self):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _loadCache(self):
+        # картинки, оставшиеся с прошлого запуска, в порядке их появления
+        files = []
+        for name in os.listdir(self.cacheDir):
+            path = os.path.join(self.cacheDir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+        with self.lock:
+            self._evict()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.refill.set()
+        self.thread = threading.Thread(target=self._run, name='image-prefetch', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.refill.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def fetch(self):
+        """Скачивает одну картинку в обход пула."""
+        try:
+            with metrics.imageFetchLatency.time():
+                response = self.session.get(self.url, timeout=FETCH_TIMEOUT)
+                response.raise_for_status()
+                data = response.content
+            # проверяем только заголовок, полное декодирование оставляем потребителю
+            Image.open(BytesIO(data)).verify()
+        except Exception:
+            metrics.imageFetchErrors.inc()
+            raise
+        return data
+
+    def takeReady(self):
+        """Отдаёт готовую картинку из пула или None, если пул пуст."""
+        with self.lock:
+            while self.entries:
+                name, size = self.entries.popitem(last=False)
+                self.size -= size
+                path = os.path.join(self.cacheDir, name)
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    os.remove(path)
+                except OSError:
+                    logger.warning("Cached image %s is gone", name)
+                    continue
+                break
+            else:
+                data = None
+
+            if len(self.entries) <= self.lowWater:
+                self.refill.set()
+        return data
+
+    def take(self):
+        """Отдаёт картинку из пула, а если он пуст - скачивает сразу."""
+        data = self.takeReady()
+        if data is None:
+            data = self.fetch()
+        return data
+
+    def add(self, data):
+        name = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}.img'
+        path = os.path.join(self.cacheDir, name)
+        # пишем во временный файл, чтобы при падении не остался обрывок
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+        with self.lock:
+            self.entries[name] = len(data)
+            self.size += len(data)
+            return self._evict()
+
+    def _evict(self):
+        evicted = 0
+        while self.entries and (len(self.entries) > self.maxCount or self.size > self.maxBytes):
+            name, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.cacheDir, name))
+            except OSError:
+                pass
+            evicted += 1
+        return evicted
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.refill.wait()
+            self.refill.clear()
+            while not self.stopped.is_set() and len(self.entries) < self.maxCount:
+                try:
+                    # упёрлись в лимит по размеру - дальше качать бессмысленно
+                    if self.add(self.fetch()):
+                        break
+                except Exception as e:
+                    logger.warning("Image prefetch failed: %s", e)
+                    self.stopped.wait(RETRY_DELAY)
+
+
+pool = None
+poolLock = threading.Lock()
+
+# общий пул, создаётся и запускается при первом обращении
+def getPool():
+    global pool
+    with poolLock:
+        if pool is None:
+            pool = ImagePool()
+            pool.start()
+            metrics.registry.gauge('image_pool_size', 'Prefetched images ready to use', fn=pool.__len__)
+    return pool
@@ -0,0 +1,54 @@
+import time
+
+import telebot
+
+from controllers import suggestIndex
+
+# тексты ответов бота, общие для polling и async режимов
+START_ADMIN = 'Привет! Я бот "Котов и Емо", могу посмотреть предложку или предложить пост сам'
+START_GUEST = "Привет! Я бот 'Котов и Эмо', но ты незнакомый мне человек.\nПодписывайся на наш паблик: https://vk.com/emomew"
+SUGGESTION = 'Предложенные посты в паблике:'
+GENERATE = 'Сгенерируем пост для паблика'
+NO_SUGGESTIONS = 'Предложенных постов нет'
+
+
+# inline клавиатура стартового сообщения
+def startKeyboard():
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    btn_suggestion = telebot.types.InlineKeyboardButton(text="Предложка", callback_data='suggestion')
+    btn_gen_post = telebot.types.InlineKeyboardButton(text="Создать пост", callback_data = 'generate_post')
+    keyboard.add(btn_suggestion, btn_gen_post)
+    return keyboard
+
+
+
+def scheduled(post):
+    slot = time.strftime('%d.%m %H:%M', time.localtime(post['slot']))
+    return f"Пост #{post['id']} поставлен в очередь, публикация {slot}"
+
+
+# текст и клавиатура страницы предложки
+def suggestionPage(entries, page, total, pageSize=suggestIndex.PAGE_SIZE):
+    if not entries:
+        text = NO_SUGGESTIONS
+    else:
+        lines = [SUGGESTION]
+        for entry in entries:
+            date = time.strftime('%d.%m %H:%M', time.localtime(entry['date'] or 0))
+            lines.append(f"\n#{entry['id']} от id{entry['from_id']}, {date}")
+            if entry['text']:
+                lines.append(entry['text'][:300])
+            if entry['attachments']:
+                lines.append(f"Вложений: {len(entry['attachments'])}")
+        text = '\n'.join(lines)
+
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    buttons = []
+    if page > 0:
+        buttons.append(telebot.types.InlineKeyboardButton(text="<<", callback_data=f'suggestion_page:{page - 1}'))
+    if (page + 1) * pageSize < total:
+        buttons.append(telebot.types.InlineKeyboardButton(text=">>", callback_data=f'suggestion_page:{page + 1}'))
+    if buttons:
+        keyboard.row(*buttons)
+    keyboard.add(telebot.types.InlineKeyboardButton(text="Обновить", callback_data='suggestion_refresh'))
+    return text, keyboard
@@ -0,0 +1,325 @@
+import os, asyncio, functools, logging, threading, time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from health_ping import HealthPing
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+# сколько секунд без ответа getUpdates считается зависшим polling
+HEARTBEAT_TIMEOUT = int(os.getenv('HEARTBEAT_TIMEOUT', 120))
+# сколько ошибок VK подряд считается недоступностью VK
+VK_ERROR_THRESHOLD = int(os.getenv('VK_ERROR_THRESHOLD', 5))
+# сколько секунд после последней ошибки VK считается недоступным, если новых вызовов не было
+VK_ERROR_TTL = int(os.getenv('VK_ERROR_TTL', 300))
+HEALTH_PING_URL = os.getenv('HEALTH_PING_URL')
+HEALTH_PING_SCHEDULE = os.getenv('HEALTH_PING_SCHEDULE', '*/5 * * * *')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def labelText(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{labelText(self.labels, key)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Значение "сейчас". fn, если задана, вызывается при каждом снятии метрик."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.fn is not None:
+            try:
+                self.set(self.fn())
+            except Exception as e:
+                logger.warning("Gauge %s failed: %s", self.name, e)
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # [счётчики по корзинам..., количество, сумма]
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for number, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[number] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{labelText(self.labels + ("le",), key + (bound,))} {count}')
+                lines.append(f'{self.name}_bucket{labelText(self.labels + ("le",), key + ("+Inf",))} {counts[-2]}')
+                lines.append(f'{self.name}_count{labelText(self.labels, key)} {counts[-2]}')
+                lines.append(f'{self.name}_sum{labelText(self.labels, key)} {counts[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self.register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handlerLatency = registry.histogram('bot_handler_seconds', 'Telegram handler latency', ('handler',))
+handlerErrors = registry.counter('bot_handler_errors_total', 'Telegram handler exceptions', ('handler',))
+handlersInFlight = registry.gauge('bot_handlers_in_flight', 'Telegram handlers running now', ('handler',))
+vkLatency = registry.histogram('vk_call_seconds', 'VK method latency from enqueue to result', ('method',))
+vkRequestLatency = registry.histogram('vk_request_seconds', 'VK HTTP request latency', ('method',))
+vkErrors = registry.counter('vk_errors_total', 'VK call errors', ('method', 'code'))
+vkInFlight = registry.gauge('vk_calls_in_flight', 'VK calls queued or running')
+vkRetries = registry.counter('vk_retries_total', 'VK calls retried after rate limiting', ('method',))
+imageFetchLatency = registry.histogram('image_fetch_seconds', 'Image source download latency')
+imageFetchErrors = registry.counter('image_fetch_errors_total', 'Image source download errors')
+# фото предложки лежат на CDN VK: битая ссылка на удалённое фото - не недоступность API
+photoDownloadLatency = registry.histogram('suggest_photo_download_seconds', 'Suggested photo download latency')
+photoDownloadErrors = registry.counter('suggest_photo_download_errors_total', 'Suggested photo download errors')
+
+# health: время последнего признака жизни по имени, ошибки VK подряд и время последней
+heartbeats = {}
+vkState = {'consecutiveErrors': 0, 'lastError': 0.0}
+vkStateLock = threading.Lock()
+
+
+def handler(name):
+    """Декоратор хендлера: время, ошибки и количество одновременно выполняемых."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                handlersInFlight.inc(handler=name)
+                try:
+                    with handlerLatency.time(handler=name):
+                        return await func(*args, **kwargs)
+                except Exception:
+                    handlerErrors.inc(handler=name)
+                    raise
+                finally:
+                    handlersInFlight.dec(handler=name)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                handlersInFlight.inc(handler=name)
+                try:
+                    with handlerLatency.time(handler=name):
+                        return func(*args, **kwargs)
+                except Exception:
+                    handlerErrors.inc(handler=name)
+                    raise
+                finally:
+                    handlersInFlight.dec(handler=name)
+        return wrapper
+    return decorator
+
+
+def heartbeat(name):
+    heartbeats[name] = time.time()
+
+
+def vkResult(method, seconds, error=None):
+    vkLatency.observe(seconds, method=method)
+    vkOutcome(method, error)
+
+
+def vkOutcome(method, error=None):
+    if error is not None:
+        vkErrors.inc(method=method, code=getattr(error, 'code', None) or type(error).__name__)
+    with vkStateLock:
+        if error is None:
+            vkState['consecutiveErrors'] = 0
+        else:
+            vkState['consecutiveErrors'] += 1
+            vkState['lastError'] = time.time()
+
+
+@contextmanager
+def vkRequest(method):
+    """HTTP-запрос к VK в обход VkClient (загрузка фото на стену): время, ошибки и здоровье VK."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        vkRequestLatency.observe(time.perf_counter() - started, method=method)
+        vkOutcome(method, e)
+        raise
+    vkRequestLatency.observe(time.perf_counter() - started, method=method)
+    vkOutcome(method)
+
+
+def health():
+    """Список проблем, пустой - всё в порядке."""
+    problems = []
+    now = time.time()
+    for name, last in heartbeats.items():
+        if now - last > HEARTBEAT_TIMEOUT:
+            problems.append(f'{name} stalled for {int(now - last)}s')
+    # без новых вызовов VK некому сбросить счётчик, поэтому красное состояние истекает само
+    with vkStateLock:
+        errors, lastError = vkState['consecutiveErrors'], vkState['lastError']
+    if errors >= VK_ERROR_THRESHOLD and now - lastError < VK_ERROR_TTL:
+        problems.append(f"VK failed {errors} times in a row, last {int(now - lastError)}s ago")
+    return problems
+
+
+registry.gauge('bot_healthy', '1 if health checks pass', fn=lambda: int(not health()))
+
+
+class MetricsServer:
+    """HTTP-эндпоинт: /metrics в формате Prometheus и /health (200 или 503)."""
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True)
+        self.thread.start()
+        logger.info("Metrics listening on port %s", self.port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def reply(self, code, body, contentType='text/plain; charset=utf-8'):
+        data = body.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            self.reply(200, registry.render(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif path == '/health':
+            problems = health()
+            self.reply(503 if problems else 200, '\n'.join(problems) or 'ok')
+        else:
+            self.reply(404, 'not found')
+
+
+def startHealthPing(url=HEALTH_PING_URL, schedule=HEALTH_PING_SCHEDULE):
+    """
+    Пинг внешнего мониторинга по расписанию. Если health() нашёл проблемы,
+    пингуется url + '/fail' (соглашение healthchecks.io), и проверка краснеет.
+    """
+    if not url:
+        return None
+    ping = HealthPing(url=url, body=None, schedule=schedule, retries=[30, 60])
+
+    def choose():
+        problems = health()
+        if problems:
+            logger.warning("Health check failed: %s", '; '.join(problems))
+        ping.url = url.rstrip('/') + '/fail' if problems else url
+
+    ping.pre_fire = choose
+    ping.start()
+    return ping
@@ -0,0 +1,228 @@
+import os, json, logging, sqlite3, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from crontab import CronTab
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('POST_QUEUE_DB', os.path.join('.cache', 'posts.sqlite3'))
+# слоты публикации в формате crontab, по одному посту на слот
+SCHEDULE = os.getenv('POST_SCHEDULE', '0 9,13,18,21 * * *')
+# за сколько до слота отдавать пост в VK как отложенный (publish_date)
+POSTPONE_AHEAD = int(os.getenv('POST_POSTPONE_AHEAD', 24 * 3600))
+# publish_date ближе этого VK может не принять, такие посты публикуем сразу
+MIN_POSTPONE = 120
+MAX_WORKERS = int(os.getenv('POST_WORKERS', 2))
+MAX_ATTEMPTS = int(os.getenv('POST_MAX_ATTEMPTS', 5))
+RETRY_DELAY = 30
+POLL_INTERVAL = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL UNIQUE,
+    message TEXT,
+    attachments TEXT,
+    slot INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    vk_post_id INTEGER,
+    created INTEGER NOT NULL,
+    submitted INTEGER
+);
+CREATE INDEX IF NOT EXISTS posts_due ON posts (status, slot);
+"""
+
+
+def nextSlot(after, schedule=SCHEDULE):
+    """Ближайший слот расписания строго после after (unix time)."""
+    slot = CronTab(schedule).next(now=datetime.fromtimestamp(after), return_datetime=True, default_utc=False)
+    return int(slot.timestamp())
+
+
+class PostQueue:
+    """
+    Очередь постов на публикацию в SQLite.
+
+    Каждый пост получает свой слот по расписанию и ключ идемпотентности.
+    Ключ уходит в wall.post как guid, поэтому повторная отправка после
+    падения не создаст второй пост.
+    """
+    def __init__(self, path=DB_PATH, schedule=SCHEDULE):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.schedule = schedule
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            if path != ':memory:':
+                self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=FULL')
+            self.db.executescript(SCHEMA)
+
+    def enqueue(self, message, attachments, idem_key):
+        """Ставит пост в очередь, возвращает строку поста (старую, если ключ уже был)."""
+        now = int(time.time())
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('SELECT * FROM posts WHERE idem_key = ?', (idem_key,)).fetchone()
+                if row is None:
+                    last = self.db.execute("SELECT MAX(slot) FROM posts WHERE status != 'failed'").fetchone()[0]
+                    slot = nextSlot(max(now, last or 0), self.schedule)
+                    self.db.execute(
+                        'INSERT INTO posts (idem_key, message, attachments, slot, created) VALUES (?, ?, ?, ?, ?)',
+                        (idem_key, message, json.dumps(attachments), slot, now))
+                    row = self.db.execute('SELECT * FROM posts WHERE idem_key = ?', (idem_key,)).fetchone()
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return dict(row)
+
+    def recover(self):
+        """Посты, на отправке которых процесс упал, возвращаются в очередь."""
+        with self.lock:
+            count = self.db.execute(
+                "UPDATE posts SET status = 'pending' WHERE status = 'publishing'").rowcount
+        if count:
+            logger.warning("Recovered %s posts interrupted while publishing", count)
+        return count
+
+    def claim(self, limit, now=None):
+        """Забирает до limit постов, которые пора отдавать в VK."""
+        now = now or int(time.time())
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.db.execute(
+                    "SELECT * FROM posts WHERE status = 'pending' AND next_attempt <= ? AND slot <= ? "
+                    "ORDER BY slot LIMIT ?", (now, now + POSTPONE_AHEAD, limit)).fetchall()
+                self.db.executemany("UPDATE posts SET status = 'publishing' WHERE id = ?",
+                                    [(row['id'],) for row in rows])
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        posts = [dict(row) for row in rows]
+        for post in posts:
+            post['attachments'] = json.loads(post['attachments'] or '[]')
+        return posts
+
+    def markPublished(self, post_id, vk_post_id):
+        with self.lock:
+            self.db.execute(
+                "UPDATE posts SET status = 'published', vk_post_id = ?, submitted = ?, error = NULL WHERE id = ?",
+                (vk_post_id, int(time.time()), post_id))
+
+    def markFailed(self, post_id, error):
+        """Планирует повтор с нарастающей паузой, после MAX_ATTEMPTS попыток сдаётся."""
+        with self.lock:
+            attempts = self.db.execute('SELECT attempts FROM posts WHERE id = ?', (post_id,)).fetchone()[0] + 1
+            status = 'pending' if attempts < MAX_ATTEMPTS else 'failed'
+            nextAttempt = int(time.time() + RETRY_DELAY * 2 ** (attempts - 1))
+            self.db.execute('UPDATE posts SET status = ?, attempts = ?, next_attempt = ?, error = ? WHERE id = ?',
+                            (status, attempts, nextAttempt, str(error), post_id))
+        return status
+
+    def stats(self, now=None):
+        """
+        Глубина очереди и задержка публикации.
+
+        lag - насколько самый старый просроченный пост опаздывает к своему слоту,
+        lastLag - с каким опозданием относительно слота ушёл последний пост.
+        """
+        now = now or int(time.time())
+        with self.lock:
+            counts = dict(self.db.execute('SELECT status, COUNT(*) FROM posts GROUP BY status').fetchall())
+            oldest = self.db.execute(
+                "SELECT MIN(slot) FROM posts WHERE status IN ('pending', 'publishing') AND slot <= ?",
+                (now,)).fetchone()[0]
+            last = self.db.execute(
+                "SELECT submitted, slot FROM posts WHERE status = 'published' ORDER BY submitted DESC LIMIT 1").fetchone()
+        return {
+            'depth': counts.get('pending', 0) + counts.get('publishing', 0),
+            'publishing': counts.get('publishing', 0),
+            'published': counts.get('published', 0),
+            'failed': counts.get('failed', 0),
+            'lag': now - oldest if oldest else 0,
+            'lastLag': max(0, last['submitted'] - last['slot']) if last else 0,
+        }
+
+
+class Scheduler:
+    """
+    Разбирает очередь: отдаёт посты в wall.post не больше чем в workers потоков.
+
+    Пост со слотом в будущем уходит с publish_date и публикуется самим VK
+    точно в срок, просроченный - публикуется сразу.
+    """
+    def __init__(self, queue, session_apiVk, group_id, workers=MAX_WORKERS):
+        self.queue = queue
+        self.session = session_apiVk
+        self.group_id = group_id
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='publish')
+        self.stopped = threading.Event()
+
+    def publish(self, post):
+        # любая ошибка, в том числе в самом посте, уходит в markFailed, а не роняет цикл
+        try:
+            params = {
+                'owner_id': -int(self.group_id),
+                'from_group': 1,
+                'message': post['message'],
+                'attachments': ','.join(post['attachments']),
+                'guid': post['idem_key'],
+            }
+            if post['slot'] - time.time() >= MIN_POSTPONE:
+                params['publish_date'] = post['slot']
+            result = self.session.wall.post(**params)
+        except Exception as e:
+            status = self.queue.markFailed(post['id'], e)
+            logger.warning("Post %s failed (%s): %s", post['id'], status, e)
+            return False
+        self.queue.markPublished(post['id'], result.get('post_id'))
+        logger.info("Post %s submitted for %s", post['id'], datetime.fromtimestamp(post['slot']))
+        return True
+
+    def drain(self):
+        """Отправляет всё, что пора, возвращает количество обработанных постов."""
+        done = 0
+        while not self.stopped.is_set():
+            posts = self.queue.claim(self.workers)
+            if not posts:
+                break
+            list(self.pool.map(self.publish, posts))
+            done += len(posts)
+        return done
+
+    def run(self):
+        self.queue.recover()
+        while not self.stopped.is_set():
+            self.drain()
+            stats = self.queue.stats()
+            logger.info("Post queue: depth %s, lag %ss, failed %s", stats['depth'], stats['lag'], stats['failed'])
+            # просыпаемся к ближайшему слоту, но не реже POLL_INTERVAL
+            wait = min(POLL_INTERVAL, nextSlot(time.time(), self.queue.schedule) - time.time())
+            self.stopped.wait(max(1, wait))
+
+    def stop(self):
+        self.stopped.set()
+        self.pool.shutdown(wait=True)
+
+
+queue = None
+queueLock = threading.Lock()
+
+# общая очередь, открывается при первом обращении
+def getQueue():
+    global queue
+    with queueLock:
+        if queue is None:
+            queue = PostQueue()
+    return queue
@@ -1,20 +1,131 @@
-import os
+import os, logging
+from concurrent.futures import ThreadPoolExecutor
 
-def getImgPost():
-    return True
+import requests
 
+from controllers import suggestIndex, postQueue, dedupIndex, metrics
 
+logger = logging.getLogger(__name__)
+
+GROUP_ID = os.getenv('VK_GROUP_ID')
+UPLOAD_TIMEOUT = 30
+# сколько фото предложки скачивать одновременно при проверке на повторы
+REVIEW_WORKERS = int(os.getenv('SUGGEST_REVIEW_WORKERS', 4))
+
+# фото предложки качаются через общую сессию, соединения с CDN VK переиспользуются
+reviewSession = requests.Session()
+for prefix in ('https://', 'http://'):
+    reviewSession.mount(prefix, requests.adapters.HTTPAdapter(pool_maxsize=REVIEW_WORKERS))
+reviewPool = ThreadPoolExecutor(max_workers=REVIEW_WORKERS, thread_name_prefix='review')
+
+
+# id сообщества из аргумента или VK_GROUP_ID; без него ни загрузка фото, ни предложка не работают
+def groupId(group_id=None):
+    group_id = group_id or GROUP_ID
+    if not group_id:
+        raise ValueError("VK_GROUP_ID is not set")
+    return int(group_id)
+
+
+# загружает закодированную картинку (imagePipeline.EncodedImage) на стену сообщества,
+# возвращает строку для attachments в wall.post
+def getImgPost(session_apiVk, image, group_id=None):
+    group_id = groupId(group_id)
+    server = session_apiVk.photos.getWallUploadServer(group_id=group_id)
+    with metrics.vkRequest('photos.upload'):
+        response = requests.post(server['upload_url'], files={'photo': (image.filename, image.view)},
+                                 timeout=UPLOAD_TIMEOUT)
+        response.raise_for_status()
+    uploaded = response.json()
+    photo = session_apiVk.photos.saveWallPhoto(group_id=group_id, photo=uploaded['photo'],
+                                               server=uploaded['server'], hash=uploaded['hash'])[0]
+    return f"photo{photo['owner_id']}_{photo['id']}"
+
+
+# источника музыки пока нет, пост уходит без неё
 def getMusicPost():
-    return True
+    return None
+
+
+# собирает пост из уже загруженной картинки: текст, attachments для wall.post и хэши для проверки на повторы
+def buildPackage(image, photo, message='', music=None):
+    attachments = [photo]
+    if music:
+        attachments.append(music)
+    hashes = [image.hash] if image.hash is not None else []
+    return {'message': message, 'attachments': attachments, 'hashes': hashes}
+
+
+# загружает картинку и собирает пост, см. buildPackage
+def packagePost(session_apiVk, image, message='', music=None, group_id=None):
+    return buildPackage(image, getImgPost(session_apiVk, image, group_id), message, music)
+
+
+# ставит собранный пост в очередь публикации, idem_key защищает от повторной постановки;
+# картинки поста запоминаются, чтобы больше их не предлагать
+def createPost(package, idem_key):
+    post = postQueue.getQueue().enqueue(package['message'], package['attachments'], idem_key)
+    index = dedupIndex.getIndex()
+    for value in package.get('hashes', []):
+        index.addIfNew(value, f"post:{post['id']}", 0)
+    return post
+
+
+# самая маленькая копия фото, которой хватает для перцептивного хэша
+def photoUrl(photo, minSide=64):
+    sizes = sorted(photo.get('sizes', []), key=lambda size: size.get('width', 0) * size.get('height', 0))
+    for size in sizes:
+        if max(size.get('width', 0), size.get('height', 0)) >= minSide:
+            return size['url']
+    return sizes[-1]['url'] if sizes else None
+
+
+# предложенный пост с уже встречавшейся картинкой (в сгенерированных постах или
+# в другом предложенном) помечается дубликатом и в предложке не показывается;
+# картинки нового поста запоминаются, чтобы не пропустить их повтор
+def reviewSuggestion(item):
+    hashes = []
+    for attachment in item.get('attachments', []):
+        url = photoUrl(attachment['photo']) if attachment.get('type') == 'photo' else None
+        if not url:
+            continue
+        try:
+            with metrics.photoDownloadLatency.time():
+                response = reviewSession.get(url, timeout=UPLOAD_TIMEOUT)
+                response.raise_for_status()
+        except requests.RequestException as e:
+            metrics.photoDownloadErrors.inc()
+            logger.warning("Can't download suggested photo %s: %s", url, e)
+            continue
+        try:
+            hashes.append(dedupIndex.imageHash(response.content))
+        except OSError as e:
+            logger.warning("Can't check suggested photo %s: %s", url, e)
+
+    index = dedupIndex.getIndex()
+    for value in hashes:
+        if not index.addIfNew(value, f"suggest:{item['id']}"):
+            return 'duplicate'
+    return 'new'
 
 
-def packagePost():
-    return True
+# статусы новых постов предложки, фото проверяются параллельно, не больше REVIEW_WORKERS сразу
+def reviewSuggestions(items):
+    return list(reviewPool.map(reviewSuggestion, items))
 
 
-def createPost():
-    return True
+# страница предложенных постов из локального индекса,
+# sync - догрузить новые посты, если индекс давно не обновлялся,
+# force - пройти всю предложку в VK и убрать из индекса посты, которых там больше нет
+def suggestedEntries(session_apiVk, page=0, sync=True, force=False, group_id=None):
+    index = suggestIndex.getIndex()
+    owner_id = -groupId(group_id)
 
+    def fetch(offset, count):
+        return session_apiVk.wall.get(owner_id=owner_id, filter='suggests', offset=offset, count=count)
 
-def suggestedEntries():
-    return True
\ No newline at end of file
+    if force:
+        index.sync(fetch, reviewSuggestions, full=True)
+    elif sync:
+        index.syncIfStale(fetch, reviewSuggestions)
+    return index.page(page)
\ No newline at end of file
@@ -0,0 +1,198 @@
+import os, json, logging, sqlite3, threading, time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('SUGGEST_DB', os.path.join('.cache', 'suggests.sqlite3'))
+# сколько записей просить у wall.get за раз (максимум VK - 100)
+FETCH_COUNT = 100
+# сколько постов прошлой страницы запрашивать повторно: если между запросами
+# часть постов ушла со стены, сдвиг не больше OVERLAP ничего не пропустит
+OVERLAP = 10
+# сколько раз начинать обход заново, если стена сдвинулась сильнее
+MAX_RESTARTS = 3
+# как часто кнопка "Предложка" может ходить в VK за новыми постами
+SYNC_INTERVAL = int(os.getenv('SUGGEST_SYNC_INTERVAL', 60))
+PAGE_SIZE = int(os.getenv('SUGGEST_PAGE_SIZE', 5))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suggests (
+    id INTEGER PRIMARY KEY,
+    from_id INTEGER,
+    date INTEGER,
+    text TEXT,
+    attachments TEXT,
+    status TEXT NOT NULL DEFAULT 'new'
+);
+CREATE INDEX IF NOT EXISTS suggests_status ON suggests (status, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SuggestIndex:
+    """
+    Локальный индекс предложенных постов в SQLite.
+
+    sync() забирает из VK только посты, которых ещё нет в индексе, а при
+    полной сверке отмечает ушедшие со стены. Листинг в Telegram строится
+    из индекса без обращений к VK.
+    """
+    def __init__(self, path=DB_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        # текущая синхронизация: (полная ли, Future с её результатом)
+        self.syncLock = threading.Lock()
+        self.running = None
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def getMeta(self, key, default=None):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    # вызывается под self.lock, внутри транзакции
+    def setMeta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def isStale(self, maxAge=SYNC_INTERVAL):
+        return time.time() - float(self.getMeta('last_sync', 0)) >= maxAge
+
+    def sync(self, fetch, review=None, full=False):
+        """
+        Догружает новые предложенные посты.
+
+        fetch(offset, count) - вызов wall.get с filter=suggests, возвращает его
+        ответ. VK отдаёт посты от новых к старым; страницы запрашиваются
+        внахлёст и сверяются по id, так что посты, ушедшие со стены во время
+        обхода, не сдвигают следующие мимо индекса. Без full обход
+        останавливается на первой странице с уже известным постом, с full
+        проходит всю стену и помечает 'gone' посты, которых в ней больше нет
+        (их приняли, отклонили или удалили в VK). review(items), если задан,
+        возвращает статусы новых постов в том же порядке. Возвращает
+        количество новых постов.
+
+        Одновременно идёт одна синхронизация: вызванные во время неё ждут
+        её результата, а не обходят стену и не проверяют те же фото заново.
+        Полная сверка не довольствуется результатом неполной и после неё
+        запускает свою.
+        """
+        while True:
+            with self.syncLock:
+                running = self.running
+                if running is None:
+                    future = Future()
+                    self.running = (full, future)
+                    break
+            result = running[1].result()
+            if running[0] or not full:
+                return result
+
+        try:
+            result = self._sync(fetch, review, full)
+        except BaseException as e:
+            with self.syncLock:
+                self.running = None
+            future.set_exception(e)
+            raise
+        with self.syncLock:
+            self.running = None
+        future.set_result(result)
+        return result
+
+    def _sync(self, fetch, review, full):
+        with self.lock:
+            known = {row['id'] for row in self.db.execute('SELECT id FROM suggests')}
+        seen = {}
+        offset = 0
+        pages = 0
+        restarts = 0
+        gaps = False
+        while True:
+            # нахлёст меньше страницы, иначе обход не продвинется
+            start = max(0, offset - min(OVERLAP, FETCH_COUNT // 2))
+            response = fetch(start, FETCH_COUNT)
+            pages += 1
+            items = response.get('items', [])
+            # страница (даже пустая) не задела ни одного поста предыдущей - между ними могли проскочить посты
+            if start and not any(item['id'] in seen for item in items):
+                if restarts < MAX_RESTARTS:
+                    restarts += 1
+                    offset = 0
+                    continue
+                gaps = True
+            for item in items:
+                seen.setdefault(item['id'], item)
+            offset = start + len(items)
+            if len(items) < FETCH_COUNT or offset >= response.get('count', 0):
+                complete = True
+                break
+            if not full and any(item['id'] in known for item in items):
+                complete = False
+                break
+
+        fresh = [item for post_id, item in seen.items() if post_id not in known]
+        statuses = review(fresh) if review and fresh else ['new'] * len(fresh)
+        rows = [(item['id'], item.get('from_id'), item.get('date'), item.get('text', ''),
+                 json.dumps(item.get('attachments', []), ensure_ascii=False), status)
+                for item, status in zip(fresh, statuses)]
+        gone = known - seen.keys() if full and complete and not gaps else set()
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO suggests (id, from_id, date, text, attachments, status) VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+            self.db.executemany(
+                "UPDATE suggests SET status = 'gone' WHERE id = ? AND status IN ('new', 'duplicate')",
+                [(post_id,) for post_id in gone])
+            self.setMeta('last_sync', time.time())
+
+        if gaps:
+            logger.warning("Suggests wall kept shifting, some posts may be picked up only by the next sync")
+        logger.info("Suggests synced: %s new, %s checked for removal, %s pages", len(fresh), len(gone), pages)
+        return len(fresh)
+
+    def syncIfStale(self, fetch, review=None, maxAge=SYNC_INTERVAL):
+        if self.isStale(maxAge):
+            return self.sync(fetch, review)
+        return 0
+
+    def page(self, page=0, size=PAGE_SIZE, status='new'):
+        """Страница постов от новых к старым и общее число постов с этим статусом."""
+        with self.lock:
+            total = self.db.execute('SELECT COUNT(*) FROM suggests WHERE status = ?', (status,)).fetchone()[0]
+            rows = self.db.execute(
+                'SELECT * FROM suggests WHERE status = ? ORDER BY id DESC LIMIT ? OFFSET ?',
+                (status, size, page * size)).fetchall()
+        return [self._entry(row) for row in rows], total
+
+    def get(self, post_id):
+        with self.lock:
+            row = self.db.execute('SELECT * FROM suggests WHERE id = ?', (post_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def setStatus(self, post_id, status):
+        with self.lock, self.db:
+            self.db.execute('UPDATE suggests SET status = ? WHERE id = ?', (status, post_id))
+
+    def _entry(self, row):
+        entry = dict(row)
+        entry['attachments'] = json.loads(entry['attachments'] or '[]')
+        return entry
+
+
+index = None
+indexLock = threading.Lock()
+
+# общий индекс, открывается при первом обращении
+def getIndex():
+    global index
+    with indexLock:
+        if index is None:
+            index = SuggestIndex()
+    return index
@@ -0,0 +1,259 @@
+import os, heapq, itertools, json, logging, queue, threading, time
+from concurrent.futures import Future
+
+import requests
+
+from controllers import metrics
+
+logger = logging.getLogger(__name__)
+
+VK_API_URL = os.getenv('VK_API_URL', 'https://api.vk.com')
+APIVersionVk = 5.131
+# сколько запросов в секунду можно делать с одним токеном (у ключа сообщества 20, у пользователя 3)
+RATE_LIMIT = float(os.getenv('VK_RATE_LIMIT', 3))
+# execute принимает не больше 25 обращений к API
+BATCH_SIZE = 25
+# сколько ждать попутных вызовов, прежде чем отправить пачку
+BATCH_DELAY = float(os.getenv('VK_BATCH_DELAY', 0.02))
+MAX_RETRIES = 5
+RETRY_DELAY = 0.5
+REQUEST_TIMEOUT = 30
+TOO_MANY_REQUESTS = 6
+
+
+class VkApiError(Exception):
+    def __init__(self, method, error):
+        self.method = method
+        self.code = error.get('error_code')
+        self.error = error
+        super().__init__(f"VK {method} error {self.code}: {error.get('error_msg')}")
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: не больше rate запросов в секунду, всплеск до capacity.
+    По умолчанию всплесков нет, запросы идут равномерно - VK считает лимит строго.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+buckets = {}
+bucketsLock = threading.Lock()
+
+# один лимит на токен, сколько бы клиентов его ни использовало
+def getBucket(token, rate=RATE_LIMIT):
+    with bucketsLock:
+        if token not in buckets:
+            buckets[token] = TokenBucket(rate)
+        return buckets[token]
+
+
+class VkCall:
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.future = Future()
+        self.created = time.perf_counter()
+        self.attempts = 0
+        self.finished = False
+        metrics.vkInFlight.inc()
+
+    def start(self):
+        """
+        Переводит Future в работу, после этого отменить его уже нельзя
+        (asyncio.wrap_future при отмене задачи отменяет и его).
+        False - вызов отменили, пока он ждал в очереди, отправлять его не нужно.
+        """
+        if self.future.set_running_or_notify_cancel():
+            return True
+        self.finished = True
+        metrics.vkInFlight.dec()
+        return False
+
+    def resolve(self, result):
+        if self.finished:
+            return
+        self.future.set_result(result)
+        self._done(None)
+
+    def fail(self, error):
+        if self.finished:
+            return
+        self.future.set_exception(error)
+        self._done(error)
+
+    def _done(self, error):
+        self.finished = True
+        metrics.vkInFlight.dec()
+        metrics.vkResult(self.method, time.perf_counter() - self.created, error)
+
+
+class VkClient:
+    """
+    Клиент VK API, который склеивает вызовы в execute.
+
+    call() ставит метод в очередь и сразу возвращает Future. Фоновый поток
+    собирает до BATCH_SIZE вызовов в один execute и отправляет их с учётом
+    лимита токена. Ошибку 6 (слишком много запросов) повторяет с нарастающей
+    паузой: такой вызов откладывается до своего времени, а поток тем временем
+    отправляет остальные, так что один упёршийся в лимит вызов не держит чужие.
+    """
+    def __init__(self, token, version=APIVersionVk, apiUrl=VK_API_URL, rate=RATE_LIMIT,
+                 batchSize=BATCH_SIZE, batchDelay=BATCH_DELAY, session=None):
+        self.token = token
+        self.version = version
+        self.apiUrl = apiUrl.rstrip('/')
+        self.bucket = getBucket(token, rate)
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+        self.session = session or requests.Session()
+        self.calls = queue.Queue()
+        # отложенные повторы: (не раньше, порядковый номер, вызов), трогает только фоновый поток
+        self.delayed = []
+        self.sequence = itertools.count()
+        self.thread = threading.Thread(target=self._run, name='vk-batch', daemon=True)
+        self.thread.start()
+
+    def call(self, method, **params):
+        # версию задаёт сам execute, у вложенных вызовов она не нужна
+        params.pop('v', None)
+        call = VkCall(method, params)
+        self.calls.put(call)
+        return call.future
+
+    def get_api(self, wait=True):
+        """Объект в стиле vk: api.wall.post(...). При wait=False вызовы возвращают Future."""
+        return VkMethod(self, None, wait)
+
+    def _run(self):
+        while True:
+            batch = self._due(self.batchSize)
+            if not batch:
+                try:
+                    call = self.calls.get(timeout=self._untilDue())
+                except queue.Empty:
+                    continue
+                if call.start():
+                    batch.append(call)
+            deadline = time.monotonic() + self.batchDelay
+            while len(batch) < self.batchSize:
+                try:
+                    call = self.calls.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if call.start():
+                    batch.append(call)
+            if batch:
+                self._send(batch)
+
+    def _due(self, limit):
+        """Отложенные вызовы, время повтора которых уже пришло."""
+        now = time.monotonic()
+        due = []
+        while self.delayed and self.delayed[0][0] <= now and len(due) < limit:
+            due.append(heapq.heappop(self.delayed)[2])
+        return due
+
+    def _untilDue(self):
+        # None - отложенных нет, ждём новых вызовов сколько угодно
+        if not self.delayed:
+            return None
+        return max(0, self.delayed[0][0] - time.monotonic())
+
+    def _send(self, batch):
+        try:
+            retry = self._sendOnce(batch)
+        except Exception as e:
+            for call in batch:
+                call.fail(e)
+            return
+
+        for call, error in retry.items():
+            if call.attempts >= MAX_RETRIES:
+                call.fail(VkApiError(call.method, error))
+                continue
+            delay = RETRY_DELAY * 2 ** call.attempts
+            call.attempts += 1
+            metrics.vkRetries.inc(method=call.method)
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.sequence), call))
+        if retry:
+            logger.warning("VK rate limit hit, %s calls postponed", len(retry))
+
+    def request(self, method, params):
+        self.bucket.acquire()
+        data = dict(params, access_token=self.token, v=self.version)
+        with metrics.vkRequestLatency.time(method=method):
+            response = self.session.post(f'{self.apiUrl}/method/{method}', data=data, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def _sendOnce(self, batch):
+        """Отправляет пачку, возвращает {вызов: ошибка} для тех, что надо повторить."""
+        if len(batch) == 1:
+            call = batch[0]
+            result = self.request(call.method, call.params)
+            if 'error' in result:
+                if result['error'].get('error_code') == TOO_MANY_REQUESTS:
+                    return {call: result['error']}
+                call.fail(VkApiError(call.method, result['error']))
+            else:
+                call.resolve(result['response'])
+            return {}
+
+        code = 'return [%s];' % ','.join(
+            f'API.{call.method}({json.dumps(call.params, ensure_ascii=False)})' for call in batch)
+        result = self.request('execute', {'code': code})
+        if 'error' in result:
+            if result['error'].get('error_code') == TOO_MANY_REQUESTS:
+                return {call: result['error'] for call in batch}
+            for call in batch:
+                call.fail(VkApiError('execute', result['error']))
+            return {}
+
+        # упавший внутри execute вызов возвращает false, а его ошибка идёт
+        # в execute_errors в том же порядке
+        errors = iter(result.get('execute_errors', []))
+        responses = result['response']
+        if len(responses) != len(batch):
+            raise ValueError(f"execute returned {len(responses)} results for {len(batch)} calls")
+        retry = {}
+        for call, response in zip(batch, responses):
+            error = next(errors, None) if response is False else None
+            if error is None:
+                call.resolve(response)
+            elif error.get('error_code') == TOO_MANY_REQUESTS:
+                retry[call] = error
+            else:
+                call.fail(VkApiError(call.method, error))
+        return retry
+
+
+class VkMethod:
+    def __init__(self, client, name, wait):
+        self.client = client
+        self.name = name
+        self.wait = wait
+
+    def __getattr__(self, name):
+        return VkMethod(self.client, f'{self.name}.{name}' if self.name else name, self.wait)
+
+    def __call__(self, **params):
+        future = self.client.call(self.name, **params)
+        return future.result() if self.wait else future
@@ -0,0 +1,161 @@
+import os, json, hmac, logging, queue, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+# сколько апдейтов может ждать один воркер, дальше просим Telegram повторить позже
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY = 1024 * 1024
+
+
+def updateChatId(update):
+    """Чат апдейта, по нему апдейты раскладываются по воркерам."""
+    for key in ('message', 'edited_message', 'channel_post', 'callback_query'):
+        event = update.get(key)
+        if not event:
+            continue
+        if key == 'callback_query':
+            chat = (event.get('message') or {}).get('chat') or event.get('from') or {}
+        else:
+            chat = event.get('chat') or {}
+        return chat.get('id', 0)
+    return 0
+
+
+class WebhookServer:
+    """
+    Приём апдейтов от Telegram через webhook.
+
+    HTTP-сервер проверяет секретный токен, сразу отвечает 200 и кладёт апдейт
+    в очередь. Апдейты одного чата всегда попадают к одному воркеру, поэтому
+    обрабатываются по порядку, разные чаты идут параллельно. Воркеры отдают
+    апдейты в bot.process_new_updates, так что хендлеры те же, что и в polling.
+    Без секрета сервер не создаётся: иначе любой может прислать апдейт от имени админа.
+    """
+    def __init__(self, bot, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                 workers=WEBHOOK_WORKERS, queueSize=WEBHOOK_QUEUE_SIZE):
+        if not secret:
+            raise ValueError("Webhook secret is required")
+        self.bot = bot
+        self.secret = secret
+        self.queues = [queue.Queue(queueSize) for _ in range(workers)]
+        self.threads = []
+        self.server = ThreadingHTTPServer((host, port), self._handlerClass())
+        self.server.daemon_threads = True
+
+        self.statsLock = threading.Lock()
+        self.started = None
+        self.received = 0
+        self.processed = 0
+        self.rejected = 0
+        self.latencyTotal = 0.0
+        self.latencyMax = 0.0
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def _handlerClass(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+            def reply(self, code):
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                received = time.perf_counter()
+                token = self.headers.get(SECRET_HEADER, '')
+                if not hmac.compare_digest(token.encode(), webhook.secret.encode()):
+                    return self.reply(403)
+
+                length = int(self.headers.get('Content-Length') or 0)
+                if not 0 < length <= MAX_BODY:
+                    return self.reply(400)
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except ValueError:
+                    return self.reply(400)
+                self.reply(200 if webhook.put(update, received) else 503)
+
+        return Handler
+
+    def put(self, update, received=None):
+        shard = self.queues[hash(updateChatId(update)) % len(self.queues)]
+        try:
+            shard.put_nowait((received or time.perf_counter(), update))
+        except queue.Full:
+            with self.statsLock:
+                self.rejected += 1
+            logger.warning("Webhook queue is full, update %s rejected", update.get('update_id'))
+            return False
+        with self.statsLock:
+            self.received += 1
+        return True
+
+    def _work(self, shard):
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            received, update = item
+            try:
+                self.bot.process_new_updates([telebot.types.Update.de_json(update)])
+            except Exception:
+                logger.exception("Update %s failed", update.get('update_id'))
+            latency = time.perf_counter() - received
+            with self.statsLock:
+                self.processed += 1
+                self.latencyTotal += latency
+                self.latencyMax = max(self.latencyMax, latency)
+            shard.task_done()
+
+    def stats(self):
+        """Сколько апдейтов принято и обработано, задержка от приёма до конца обработки."""
+        with self.statsLock:
+            elapsed = time.perf_counter() - self.started if self.started else 0
+            return {
+                'received': self.received,
+                'processed': self.processed,
+                'rejected': self.rejected,
+                'queued': sum(shard.qsize() for shard in self.queues),
+                'latencyAvg': self.latencyTotal / self.processed if self.processed else 0,
+                'latencyMax': self.latencyMax,
+                'updatesPerSec': self.processed / elapsed if elapsed else 0,
+            }
+
+    def start(self):
+        self.started = time.perf_counter()
+        for number, shard in enumerate(self.queues):
+            thread = threading.Thread(target=self._work, args=(shard,), name=f'webhook-worker-{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self.server.serve_forever, name='webhook-http', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        logger.info("Webhook listening on port %s with %s workers", self.port, len(self.queues))
+
+    def join(self):
+        """Ждёт, пока воркеры разберут всё, что уже принято."""
+        for shard in self.queues:
+            shard.join()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for shard in self.queues:
+            shard.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -1,14 +1,13 @@
-import os, logging
+import os, logging, asyncio, time
 
 from dotenv import load_dotenv
-from health_ping import HealthPing
 import telebot
-import vk
 
-from controllers import admin, generateData
-
-# Загрузка переменных окружения из .env файла
+# Загрузка переменных окружения из .env файла,
+# до импорта controllers: они читают настройки при импорте
 load_dotenv()
+
+from controllers import admin, generateData, postVk, messages, asyncBot, vkClient, webhook, metrics, postQueue, imagePool
     
 # Получение токена бота из переменных окружения
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
@@ -24,15 +23,15 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
-APIVersionVk = 5.131
-vkApi = vk.API(access_token=VK_TOKEN)
-vkApi.auth() 
-session_apiVk = vkApi.get_api(v=APIVersionVk)
+APIVersionVk = vkClient.APIVersionVk
+# вызовы VK склеиваются в execute и идут с учётом лимита токена
+session_apiVk = vkClient.VkClient(VK_TOKEN, version=APIVersionVk).get_api()
 bot = telebot.TeleBot(TELEGRAM_TOKEN)
 
 
 # inline клавиатура
 @bot.message_handler(commands=['start'])
+@metrics.handler('start_message')
 def start_message(message):
     user_id = message.from_user.id
     chat_id = message.chat.id
@@ -40,38 +39,104 @@ def start_message(message):
     if (admin.checkAdmin(user_id)):
         # bot.send_message(user_id, "Привет! Я бот 'Котов и Эмо', могу посмотреть предложку или предложить пост сам")
 
-        keyboard = telebot.types.InlineKeyboardMarkup()
-        btn_suggestion = telebot.types.InlineKeyboardButton(text="Предложка", callback_data='suggestion')
-        btn_gen_post = telebot.types.InlineKeyboardButton(text="Создать пост", callback_data = 'generate_post')
-        keyboard.add(btn_suggestion, btn_gen_post)
-        bot.send_message(chat_id,
-                        'Привет! Я бот "Котов и Емо", могу посмотреть предложку или предложить пост сам',
-                        reply_markup=keyboard)
+        bot.send_message(chat_id, messages.START_ADMIN, reply_markup=messages.startKeyboard())
     else:
-        bot.send_message(user_id, "Привет! Я бот 'Котов и Эмо', но ты незнакомый мне человек.\nПодписывайся на наш паблик: https://vk.com/emomew")
+        bot.send_message(user_id, messages.START_GUEST)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == 'suggestion')
+@bot.callback_query_handler(func=lambda call: call.data in ('suggestion', 'suggestion_refresh'))
+@metrics.handler('suggestion_post')
 def suggestion_post(call):
     message = call.message
     chat_id = message.chat.id
-    bot.send_message(chat_id, f'Предложенные посты в паблике:')
+    entries, total = postVk.suggestedEntries(session_apiVk, force=call.data == 'suggestion_refresh')
+    text, keyboard = messages.suggestionPage(entries, 0, total)
+    bot.send_message(chat_id, text, reply_markup=keyboard)
+
+
+# листание предложки идёт только по локальному индексу, без запросов к VK
+@bot.callback_query_handler(func=lambda call: call.data.startswith('suggestion_page:'))
+@metrics.handler('suggestion_page')
+def suggestion_page(call):
+    message = call.message
+    page = int(call.data.split(':')[1])
+    entries, total = postVk.suggestedEntries(session_apiVk, page, sync=False)
+    text, keyboard = messages.suggestionPage(entries, page, total)
+    bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=keyboard)
 
 
 @bot.callback_query_handler(func=lambda call: call.data == 'generate_post')
-def suggestion_post(call):
+@metrics.handler('generate_post')
+def generate_post(call):
     message = call.message
     chat_id = message.chat.id
-    bot.send_message(chat_id, f'Сгенерируем пост для паблика')
-    # genPost = generateData.generatePost.generateImg()
-    # bot.send_photo(chat_id, genPost)
-    session_apiVk.wall.post(from_group=1, message="TESTPOST", v=APIVersionVk)
-    bot.send_message(chat_id, f'post is publicaed!')
+    bot.send_message(chat_id, messages.GENERATE)
+    genPost = generateData.generatePost.generateEncodedImg()
+    bot.send_photo(chat_id, (genPost.filename, genPost.view))
+    package = postVk.packagePost(session_apiVk, genPost, music=postVk.getMusicPost())
+    # id callback'а один на нажатие, повторная доставка апдейта не создаст второй пост
+    post = postVk.createPost(package, f'tg-{call.id}')
+    bot.send_message(chat_id, messages.scheduled(post))
     
 
 def main():
     """Run the bot."""
+    mode = os.getenv('BOT_MODE')
+    # без id сообщества бот не сможет ни загрузить фото, ни показать предложку
+    postVk.groupId()
+    # пул начинает качать картинки сразу, первое "Создать пост" не ждёт скачивания
+    imagePool.getPool()
+    startMetrics()
+    # BOT_MODE=async - асинхронный режим, медленные запросы к VK не блокируют других админов
+    if mode == 'async':
+        asyncio.run(asyncBot.run(TELEGRAM_TOKEN, VK_TOKEN))
+    # BOT_MODE=webhook - Telegram сам присылает апдейты на WEBHOOK_URL
+    elif mode == 'webhook':
+        runWebhook()
+    else:
+        runPolling()
+
+
+def runPolling():
+    bot.remove_webhook()
+    # каждый ответ getUpdates - признак того, что polling жив
+    get_updates = bot.get_updates
+    def heartbeat_get_updates(*args, **kwargs):
+        updates = get_updates(*args, **kwargs)
+        metrics.heartbeat('poller')
+        return updates
+    bot.get_updates = heartbeat_get_updates
+    metrics.heartbeat('poller')
     bot.infinity_polling()
 
+
+def startMetrics():
+    metrics.registry.gauge('post_queue_depth', 'Posts waiting to be published',
+                           fn=lambda: postQueue.getQueue().stats()['depth'])
+    metrics.registry.gauge('post_queue_lag_seconds', 'How late the oldest overdue post is',
+                           fn=lambda: postQueue.getQueue().stats()['lag'])
+    metrics.MetricsServer().start()
+    metrics.startHealthPing()
+
+
+def runWebhook():
+    url = os.getenv('WEBHOOK_URL')
+    # без адреса Telegram некуда слать апдейты, без секрета кто угодно пришлёт поддельный
+    if not url or not webhook.WEBHOOK_SECRET:
+        raise ValueError("BOT_MODE=webhook needs WEBHOOK_URL and WEBHOOK_SECRET")
+    # хендлеры выполняются прямо в воркерах вебхука, так сохраняется порядок внутри чата
+    bot.threaded = False
+    server = webhook.WebhookServer(bot)
+    server.start()
+    metrics.registry.gauge('webhook_queued_updates', 'Webhook updates waiting for a worker',
+                           fn=lambda: server.stats()['queued'])
+    bot.set_webhook(url=url, secret_token=webhook.WEBHOOK_SECRET)
+    try:
+        while True:
+            time.sleep(60)
+            logger.info("Webhook: %s", server.stats())
+    except KeyboardInterrupt:
+        server.stop()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
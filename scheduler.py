@@ -0,0 +1,33 @@
+import os, logging
+
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения из .env файла,
+# до импорта controllers: они читают настройки при импорте
+load_dotenv()
+
+from controllers import postQueue, postVk, vkClient
+
+VK_TOKEN = os.getenv('VK_TOKEN')
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """Publish queued posts on the POST_SCHEDULE slots."""
+    # без id сообщества ни один пост не уйдёт, лучше упасть сразу
+    group_id = postVk.groupId()
+    session_apiVk = vkClient.VkClient(VK_TOKEN).get_api()
+    scheduler = postQueue.Scheduler(postQueue.getQueue(), session_apiVk, group_id)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# настройки читаются при импорте controllers, поэтому задаются до него:
+# базы и кэш картинок - во временный каталог, лимит VK не тормозит тесты
+WORKDIR = tempfile.mkdtemp(prefix='bot-tests-')
+os.environ.update({
+    'VK_GROUP_ID': '1',
+    'VK_RATE_LIMIT': '100',
+    'ADMIN_ID': '1',
+    'IMAGE_CACHE_DIR': os.path.join(WORKDIR, 'images'),
+    'SUGGEST_DB': os.path.join(WORKDIR, 'suggests.sqlite3'),
+    'POST_QUEUE_DB': os.path.join(WORKDIR, 'posts.sqlite3'),
+    'DEDUP_DB': os.path.join(WORKDIR, 'hashes.sqlite3'),
+})
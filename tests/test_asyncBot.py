@@ -0,0 +1,78 @@
+import asyncio, time
+
+import httpx
+import telebot
+
+from bench.fakes import FakeTelegram, FakeVk
+from bench.run import Updates
+from controllers import asyncBot
+
+VK_LATENCY = 0.3
+
+
+async def runUpdates(telegram, vk, updates, token, **kwargs):
+    """Прогоняет апдейты через createBot, возвращает время готовности каждого и сам бот."""
+    async with httpx.AsyncClient() as client:
+        bot = asyncBot.createBot('1:test', token, client, apiUrl=telegram.url, vkApiUrl=vk.url, **kwargs)
+
+        # сколько вызовов предложки одновременно в работе
+        active = [0, 0]
+        suggestedEntries = bot.suggestedEntries
+        async def counted(*args, **kwargs):
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+            try:
+                return await suggestedEntries(*args, **kwargs)
+            finally:
+                active[0] -= 1
+        bot.suggestedEntries = counted
+
+        started = time.perf_counter()
+        finished = {}
+        tasks = []
+        for raw in updates:
+            task = await bot.dispatch(telebot.types.Update.de_json(raw))
+            task.add_done_callback(lambda _, number=raw['update_id']: finished.setdefault(number, time.perf_counter() - started))
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        return finished, active[1]
+
+
+def test_slow_vk_in_one_chat_does_not_block_other_chats():
+    updates = Updates()
+    slow = [updates.callback(1, 'suggestion_refresh') for _ in range(4)]
+    fast = [updates.command(100 + number) for number in range(4)]
+
+    with FakeTelegram() as telegram, FakeVk(latency=VK_LATENCY) as vk:
+        finished, _ = asyncio.run(runUpdates(telegram, vk, slow + fast, 'test-other-chats', maxChatTasks=1))
+
+    # апдейты чата 1 идут друг за другом, /start других чатов их не ждут
+    assert max(finished[raw['update_id']] for raw in slow) >= 4 * VK_LATENCY
+    assert max(finished[raw['update_id']] for raw in fast) < VK_LATENCY
+    assert telegram.stats()['requests']['sendMessage'] == 8
+
+
+def test_refreshes_of_different_chats_share_one_sync():
+    updates = Updates()
+    batch = [updates.callback(chat_id, 'suggestion_refresh') for chat_id in range(10, 18)]
+
+    with FakeTelegram() as telegram, FakeVk(latency=VK_LATENCY) as vk:
+        finished, peak = asyncio.run(runUpdates(telegram, vk, batch, 'test-overlap'))
+
+    # чаты ждут идущую синхронизацию предложки, а не обходят стену каждый сам;
+    # вторая возможна, если пулу asyncio.to_thread не хватило потоков на всех сразу
+    assert peak == len(batch)
+    assert max(finished.values()) < 3 * VK_LATENCY
+    assert sum(vk.stats()['requests'].values()) <= 2
+
+
+def test_chat_task_cap():
+    updates = Updates()
+    batch = [updates.callback(1, 'suggestion_refresh') for _ in range(6)]
+
+    with FakeTelegram() as telegram, FakeVk(latency=VK_LATENCY) as vk:
+        finished, peak = asyncio.run(runUpdates(telegram, vk, batch, 'test-cap', maxChatTasks=2))
+
+    assert peak == 2
+    assert max(finished.values()) >= 3 * VK_LATENCY
+    assert len(finished) == len(batch)
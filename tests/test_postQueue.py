@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+from controllers import postQueue
+
+SCHEDULE = '0 9,13,18,21 * * *'
+
+
+class StubWall:
+    """session_apiVk.wall: запоминает параметры wall.post, может падать."""
+    def __init__(self, error=None):
+        self.error = error
+        self.posts = []
+
+    def post(self, **params):
+        if self.error is not None:
+            raise self.error
+        self.posts.append(params)
+        return {'post_id': len(self.posts)}
+
+
+class StubSession:
+    def __init__(self, error=None):
+        self.wall = StubWall(error)
+
+
+@pytest.fixture
+def queue():
+    return postQueue.PostQueue(':memory:', SCHEDULE)
+
+
+def status(queue, post_id):
+    return queue.db.execute('SELECT status FROM posts WHERE id = ?', (post_id,)).fetchone()[0]
+
+
+def test_same_key_returns_same_post(queue):
+    first = queue.enqueue('', ['photo-1_1'], 'tg-1')
+    again = queue.enqueue('other', ['photo-1_2'], 'tg-1')
+
+    assert again == first
+    assert queue.stats()['depth'] == 1
+
+
+def test_posts_take_consecutive_slots(queue):
+    now = int(time.time())
+    slots = [queue.enqueue('', [], f'tg-{number}')['slot'] for number in range(5)]
+
+    assert slots[0] == postQueue.nextSlot(now, SCHEDULE)
+    for previous, slot in zip(slots, slots[1:]):
+        assert slot == postQueue.nextSlot(previous, SCHEDULE)
+
+
+def test_failed_posts_free_their_slot(queue):
+    first = queue.enqueue('', [], 'tg-1')
+    queue.db.execute("UPDATE posts SET status = 'failed' WHERE id = ?", (first['id'],))
+
+    assert queue.enqueue('', [], 'tg-2')['slot'] == first['slot']
+
+
+def test_recover_returns_interrupted_posts(queue):
+    post = queue.enqueue('', [], 'tg-1')
+    claimed = queue.claim(10, now=post['slot'])
+    assert [row['id'] for row in claimed] == [post['id']]
+    assert status(queue, post['id']) == 'publishing'
+    # пока пост в работе, второй раз его не выдают
+    assert queue.claim(10, now=post['slot']) == []
+
+    assert queue.recover() == 1
+    assert status(queue, post['id']) == 'pending'
+
+
+def test_claim_takes_only_posts_within_postpone_window(queue):
+    post = queue.enqueue('', [], 'tg-1')
+
+    assert queue.claim(10, now=post['slot'] - postQueue.POSTPONE_AHEAD - 1) == []
+    assert len(queue.claim(10, now=post['slot'] - postQueue.POSTPONE_AHEAD)) == 1
+
+
+@pytest.mark.parametrize('ahead, postponed', [
+    (postQueue.MIN_POSTPONE + 60, True),
+    (postQueue.MIN_POSTPONE - 60, False),
+    (-3600, False),
+])
+def test_publish_date_only_for_far_slots(queue, ahead, postponed):
+    session = StubSession()
+    scheduler = postQueue.Scheduler(queue, session, '42')
+    post = queue.enqueue('text', ['photo-42_1'], 'tg-1')
+    post.update(slot=int(time.time()) + ahead, attachments=['photo-42_1'])
+
+    assert scheduler.publish(post)
+
+    params, = session.wall.posts
+    assert params['owner_id'] == -42
+    assert params['guid'] == 'tg-1'
+    assert params['attachments'] == 'photo-42_1'
+    assert ('publish_date' in params) == postponed
+    assert status(queue, post['id']) == 'published'
+
+
+def test_failing_post_backs_off_then_gives_up(queue):
+    scheduler = postQueue.Scheduler(queue, StubSession(RuntimeError('VK is down')), '42')
+    post = queue.enqueue('', [], 'tg-1')
+    post['attachments'] = []
+
+    delays = []
+    for attempt in range(1, postQueue.MAX_ATTEMPTS + 1):
+        started = int(time.time())
+        assert not scheduler.publish(post)
+        row = queue.db.execute('SELECT * FROM posts WHERE id = ?', (post['id'],)).fetchone()
+        assert row['attempts'] == attempt
+        assert row['error'] == 'VK is down'
+        delays.append(row['next_attempt'] - started)
+        expected = 'failed' if attempt == postQueue.MAX_ATTEMPTS else 'pending'
+        assert row['status'] == expected
+
+    for attempt, delay in enumerate(delays):
+        assert abs(delay - postQueue.RETRY_DELAY * 2 ** attempt) <= 1
+    assert queue.stats()['failed'] == 1
+
+
+def test_bad_post_does_not_stop_drain(queue):
+    # без id сообщества параметры не собрать, пост уходит в повтор, а не роняет цикл
+    scheduler = postQueue.Scheduler(queue, StubSession(), None)
+    queue.enqueue('', [], 'tg-1')
+    queue.db.execute('UPDATE posts SET slot = ?', (int(time.time()),))
+
+    assert scheduler.drain() == 1
+    assert queue.stats()['publishing'] == 0
+    scheduler.stop()
@@ -0,0 +1,152 @@
+import threading, time
+
+import pytest
+
+from controllers import suggestIndex
+
+
+class Wall:
+    """
+    Предложка VK для fetch: посты от новых к старым.
+
+    changes - {номер запроса: (сколько постов убрать, с какой позиции, сколько новых добавить сверху)},
+    изменение происходит перед ответом на этот запрос.
+    """
+    def __init__(self, count, changes=None):
+        self.posts = list(range(count, 0, -1))
+        self.changes = changes or {}
+        self.nextId = count + 1
+        self.offsets = []
+        self.lock = threading.Lock()
+
+    def fetch(self, offset, count):
+        with self.lock:
+            self.offsets.append(offset)
+            remove, position, add = self.changes.get(len(self.offsets), (0, 0, 0))
+            del self.posts[position:position + remove]
+            for _ in range(add):
+                self.posts.insert(0, self.nextId)
+                self.nextId += 1
+            items = [{'id': post_id, 'text': str(post_id)} for post_id in self.posts[offset:offset + count]]
+            return {'count': len(self.posts), 'items': items}
+
+    @property
+    def walks(self):
+        return self.offsets.count(0)
+
+
+def indexed(index, status='new'):
+    return {entry['id'] for entry in index.page(0, 10 ** 6, status)[0]}
+
+
+@pytest.mark.parametrize('count, changes', [
+    (250, {}),
+    # между страницами ушло меньше OVERLAP постов
+    (250, {2: (5, 0, 0)}),
+    (250, {3: (suggestIndex.OVERLAP, 50, 0)}),
+    # ушло больше OVERLAP - обход начинается заново
+    (250, {2: (30, 0, 0)}),
+    (250, {2: (30, 0, 0), 5: (40, 0, 0)}),
+    # сверху пришли новые посты, страницы сдвинулись вниз
+    (250, {2: (0, 0, 15)}),
+    (250, {2: (20, 10, 5), 3: (3, 0, 30)}),
+])
+def test_walk_does_not_skip_shifted_posts(count, changes):
+    wall = Wall(count, changes)
+    original = set(wall.posts)
+    index = suggestIndex.SuggestIndex(':memory:')
+
+    index.sync(wall.fetch, full=True)
+
+    # все посты, что были на стене с начала обхода и остались на ней, попали в индекс
+    assert original & set(wall.posts) <= indexed(index)
+    assert indexed(index, 'gone') == set()
+
+
+@pytest.mark.parametrize('full, status, expected', [
+    (True, 'new', 'gone'),
+    (True, 'duplicate', 'gone'),
+    (True, 'published', 'published'),
+    (False, 'new', 'new'),
+])
+def test_removed_posts_are_reconciled(full, status, expected):
+    wall = Wall(150)
+    index = suggestIndex.SuggestIndex(':memory:')
+    index.sync(wall.fetch)
+    index.setStatus(140, status)
+    index.setStatus(20, status)
+
+    # пост 140 приняли в VK, пришли два новых
+    wall.posts.remove(140)
+    wall.posts[:0] = [152, 151]
+    assert index.sync(wall.fetch, full=full) == 2
+
+    assert index.get(140)['status'] == expected
+    assert index.get(20)['status'] == status
+    assert {151, 152} <= indexed(index)
+
+
+def test_incremental_sync_stops_at_known_posts():
+    wall = Wall(300)
+    index = suggestIndex.SuggestIndex(':memory:')
+    index.sync(wall.fetch)
+    walked = len(wall.offsets)
+
+    wall.posts[:0] = [302, 301]
+    assert index.sync(wall.fetch) == 2
+    assert wall.offsets[walked:] == [0]
+
+
+def test_concurrent_syncs_share_one_walk():
+    wall = Wall(50)
+    release = threading.Event()
+    fetch = wall.fetch
+    def slowFetch(offset, count):
+        release.wait(5)
+        return fetch(offset, count)
+
+    reviewed = []
+    def review(items):
+        reviewed.extend(item['id'] for item in items)
+        return ['new'] * len(items)
+
+    index = suggestIndex.SuggestIndex(':memory:')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(index.sync(slowFetch, review, full=True)))
+               for _ in range(5)]
+    threads[0].start()
+    while index.running is None:
+        time.sleep(0.001)
+    # остальные приходят, пока первый ждёт ответа VK
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [50] * 5
+    assert wall.walks == 1
+    assert sorted(reviewed) == list(range(1, 51))
+
+
+def test_full_sync_does_not_settle_for_incremental():
+    wall = Wall(50)
+    index = suggestIndex.SuggestIndex(':memory:')
+    release = threading.Event()
+    fetch = wall.fetch
+    def slowFetch(offset, count):
+        release.wait(5)
+        return fetch(offset, count)
+
+    incremental = threading.Thread(target=index.sync, args=(slowFetch,))
+    incremental.start()
+    while index.running is None:
+        time.sleep(0.001)
+    full = threading.Thread(target=index.sync, args=(wall.fetch,), kwargs={'full': True})
+    full.start()
+    release.set()
+    incremental.join()
+    full.join()
+
+    assert wall.walks == 2
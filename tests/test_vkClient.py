@@ -0,0 +1,97 @@
+import asyncio, time
+
+import pytest
+
+from bench.fakes import FakeVk
+from controllers import metrics, vkClient
+
+
+def test_requests_stay_under_rate_limit():
+    rate = 5
+    with FakeVk() as vk:
+        client = vkClient.VkClient('test-rate', apiUrl=vk.url, rate=rate, batchSize=1)
+        started = time.monotonic()
+        futures = [client.call('wall.get', owner_id=-1, count=1) for _ in range(12)]
+        for future in futures:
+            future.result(timeout=10)
+        elapsed = time.monotonic() - started
+
+    # без всплесков: за любую секунду не больше rate запросов и ещё одного на её границе
+    assert vk.peakRate('wall.get') <= rate + 1
+    assert elapsed >= (len(futures) - 1) / rate * 0.9
+
+
+def test_calls_are_batched_into_execute():
+    with FakeVk() as vk:
+        client = vkClient.VkClient('test-batch', apiUrl=vk.url, rate=5)
+        futures = [client.call('wall.post', owner_id=-1, message=str(number)) for number in range(30)]
+        results = [future.result(timeout=10) for future in futures]
+
+    assert len({result['post_id'] for result in results}) == 30
+    assert vk.stats()['requests'] == {'execute': 2}
+
+
+def test_too_many_requests_is_retried(monkeypatch):
+    monkeypatch.setattr(vkClient, 'RETRY_DELAY', 0.2)
+    with FakeVk(rateLimit=3) as vk:
+        # клиент считает, что можно 20 в секунду, VK пускает только 3
+        client = vkClient.VkClient('test-retry', apiUrl=vk.url, rate=20, batchSize=1)
+        futures = [client.call('wall.get', owner_id=-1, count=1) for _ in range(6)]
+        results = [future.result(timeout=15) for future in futures]
+
+    assert all(result['items'] for result in results)
+    assert vk.stats()['errors'].get('wall.get', 0) > 0
+
+
+def test_retry_does_not_hold_other_calls(monkeypatch):
+    monkeypatch.setattr(vkClient, 'MAX_RETRIES', 2)
+    monkeypatch.setattr(vkClient, 'RETRY_DELAY', 0.5)
+    with FakeVk(limited={'wall.post'}) as vk:
+        client = vkClient.VkClient('test-isolation', apiUrl=vk.url, rate=20)
+        post = client.call('wall.post', owner_id=-1, message='limited')
+        time.sleep(0.1)
+
+        started = time.monotonic()
+        client.call('wall.get', owner_id=-1, count=1).result(timeout=5)
+        assert time.monotonic() - started < 0.4
+
+        with pytest.raises(vkClient.VkApiError) as error:
+            post.result(timeout=5)
+
+    assert error.value.code == vkClient.TOO_MANY_REQUESTS
+    assert vk.stats()['requests']['wall.post'] == 3
+
+
+def test_cancelled_caller_does_not_break_its_batch():
+    async def scenario(client):
+        cancelled = asyncio.ensure_future(asyncio.wrap_future(client.call('wall.post', owner_id=-1, message='a')))
+        other = asyncio.wrap_future(client.call('wall.post', owner_id=-1, message='b'))
+        await asyncio.sleep(0.05)
+        # оба вызова уже в одном execute, VK выполнит их в любом случае
+        cancelled.cancel()
+        return await other
+
+    inFlight = sum(metrics.vkInFlight.values.values())
+    with FakeVk(latency=0.2) as vk:
+        client = vkClient.VkClient('test-cancel', apiUrl=vk.url, rate=20, batchDelay=0.02)
+        assert asyncio.run(scenario(client))['post_id']
+        time.sleep(0.3)
+
+    assert vk.stats()['requests'] == {'execute': 1}
+    assert sum(metrics.vkInFlight.values.values()) == inFlight
+
+
+def test_call_cancelled_in_queue_is_not_sent():
+    inFlight = sum(metrics.vkInFlight.values.values())
+    with FakeVk(latency=0.2) as vk:
+        client = vkClient.VkClient('test-cancel-queued', apiUrl=vk.url, rate=20, batchSize=1)
+        busy = client.call('wall.get', owner_id=-1, count=1)
+        time.sleep(0.05)
+        queued = client.call('wall.post', owner_id=-1, message='cancelled')
+        assert queued.cancel()
+        after = client.call('wall.get', owner_id=-1, count=1)
+        busy.result(timeout=5)
+        after.result(timeout=5)
+
+    assert vk.stats()['requests'] == {'wall.get': 2}
+    assert sum(metrics.vkInFlight.values.values()) == inFlight
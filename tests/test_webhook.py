@@ -0,0 +1,75 @@
+import json, threading, time
+from collections import defaultdict
+
+import pytest
+import requests
+
+from bench.run import Updates
+from controllers import webhook
+
+SECRET = 's3cret'
+
+
+class RecordingBot:
+    """Вместо telebot: запоминает, в каком порядке чаты получили апдейты."""
+    def __init__(self, delay=0.005):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.seen = defaultdict(list)
+
+    def process_new_updates(self, updates):
+        time.sleep(self.delay)
+        for update in updates:
+            event = update.message or update.callback_query.message
+            with self.lock:
+                self.seen[event.chat.id].append(update.update_id)
+
+
+@pytest.fixture
+def server():
+    bot = RecordingBot()
+    server = webhook.WebhookServer(bot, secret=SECRET, host='127.0.0.1', port=0, workers=4)
+    server.start()
+    yield server
+    server.stop()
+
+
+def post(server, update, secret=SECRET):
+    headers = {'Content-Type': 'application/json'}
+    if secret is not None:
+        headers[webhook.SECRET_HEADER] = secret
+    return requests.post(f'http://127.0.0.1:{server.port}/', data=json.dumps(update), headers=headers, timeout=5)
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        webhook.WebhookServer(RecordingBot(), secret=None, host='127.0.0.1', port=0)
+
+
+def test_bad_secret_is_rejected(server):
+    update = Updates().command(1)
+    assert post(server, update, 'wrong').status_code == 403
+    assert post(server, update, None).status_code == 403
+    assert server.stats()['received'] == 0
+
+
+def test_updates_keep_order_within_chat(server):
+    updates = Updates()
+    recorded = []
+    for number in range(60):
+        chat_id = 10 + number % 6
+        recorded.append(updates.command(chat_id) if number % 2 else updates.callback(chat_id, 'suggestion'))
+
+    for update in recorded:
+        assert post(server, update).status_code == 200
+    server.join()
+
+    for chat_id, numbers in server.bot.seen.items():
+        assert numbers == sorted(numbers)
+    assert sum(len(numbers) for numbers in server.bot.seen.values()) == len(recorded)
+
+    stats = server.stats()
+    assert stats['received'] == stats['processed'] == len(recorded)
+    assert stats['rejected'] == 0 and stats['queued'] == 0
+    assert 0 < stats['latencyAvg'] <= stats['latencyMax']
+    assert stats['updatesPerSec'] > 0